@@ -30,6 +30,12 @@ will be in text frames containing a JSON object with two keys: `type` and
 * `complete` - the thread has been marked complete. no further updates will
   be sent.
 
+Clients that can't use websockets can receive the same messages as
+Server-Sent Events from `/live/*thread*/stream`. Each message is an event
+with the same `type` and JSON `payload` that would be sent over the
+websocket. Connections are closed periodically; reconnect and catch up with
+[/live/*thread*/since](#GET_live_{thread}_since).
+
 See /r/live for more information.
 
 """
@@ -101,6 +107,28 @@ class LiveUpdate(Plugin):
         ],
     }
 
+    live_config = {
+        ConfigValue.bool: [
+            "liveupdate_bucket_new_streams",
+            "liveupdate_head_cache_memcache",
+            "liveupdate_sse_enabled",
+            "liveupdate_hll_counting",
+        ],
+
+        ConfigValue.str: [
+            # where viewer counts come from. one of "service" (the activity
+            # service), "hll" (the plugin's own counts) or "fallback" (the
+            # service, with the plugin's counts when it's unavailable).
+            # the plugin's counts are only used if liveupdate_hll_counting
+            # is on.
+            "liveupdate_viewer_count_source",
+        ],
+
+        ConfigValue.float: [
+            "liveupdate_sidebar_timeout",
+        ],
+    }
+
     js = {
         "liveupdate": LocalizedModule("liveupdate.js",
             "lib/page-visibility.js",
@@ -1,78 +1,363 @@
 import collections
+import contextlib
 import datetime
+import random
+import signal
+import threading
+import time
+
+import pytz
 
 from pylons import app_globals as g, tmpl_context as c
 from thrift.transport.TTransport import TTransportException
 
 from r2.lib import amqp, websockets, utils
-from r2.lib.db import tdb_cassandra
+from r2.lib.memoize import memoize
 from r2.models.query_cache import CachedQueryMutator
 from r2.models.view_counts import ViewCountsQuery
 
+from reddit_liveupdate import fanout, hll
 from reddit_liveupdate.models import (
+    ACTIVITY_RESOLUTIONS,
+    LiveUpdateActiveEventsByShard,
     LiveUpdateEvent,
     LiveUpdateActivityHistoryByEvent,
+    LiveUpdateLiveEventsIndex,
 )
 from reddit_liveupdate.queries import get_active_events
 
 
-def update_activity():
+# the most buckets a single activity series may span
+MAX_SERIES_BUCKETS = 1000
+
+# how often the daemon runs a pass and how much random delay is added to
+# each so that restarted daemons don't all hit the activity service at once
+DAEMON_INTERVAL = 60
+DAEMON_JITTER = 5
+
+# how many threads the "most active" listing holds
+MAX_ACTIVE_EVENTS = 1000
+
+# the "most active" listing is updated incrementally between full replaces
+# at least this many seconds apart
+FULL_REPLACE_INTERVAL = 60 * 60
+ACTIVE_EVENTS_REPLACED_KEY = "liveupdate_active_events_replaced"
+
+# entries in the "most active" listing expire if they aren't rewritten
+ACTIVE_EVENTS_TTL = datetime.timedelta(days=3)
+
+
+@memoize("liveupdate_activity_series", time=60)
+def _get_activity_series(event_id, resolution, start, end):
+    series = LiveUpdateActivityHistoryByEvent.get_series(
+        event_id,
+        start=datetime.datetime.fromtimestamp(start, pytz.UTC),
+        end=datetime.datetime.fromtimestamp(end, pytz.UTC),
+        resolution=resolution,
+    )
+    return [{
+        "start": utils.epoch_timestamp(bucket.start),
+        "min": bucket.min,
+        "max": bucket.max,
+        "avg": bucket.avg,
+    } for bucket in series]
+
+
+def get_activity_series(event_id, resolution, start, end):
+    """Return an event's viewer counts between two epoch times.
+
+    The range is aligned to `resolution` so that nearby requests share a
+    cache entry, and is clamped to at most MAX_SERIES_BUCKETS buckets
+    ending at `end`.
+
+    """
+    size = ACTIVITY_RESOLUTIONS[resolution]
+    end = (int(end) // size + 1) * size - 1
+    start = max(int(start) // size * size, end + 1 - MAX_SERIES_BUCKETS * size)
+    return _get_activity_series(event_id, resolution, start, end)
+
+
+def _count_activity(context_ids, activity_service):
+    source = g.live_config.get("liveupdate_viewer_count_source", "service")
+    if (source != "service" and
+            not g.live_config.get("liveupdate_hll_counting", False)):
+        # nothing is feeding the plugin's counts, so they'd all be zero
+        g.log.warning("liveupdate_viewer_count_source is %r but "
+                      "liveupdate_hll_counting is off, using the service",
+                      source)
+        source = "service"
+
+    if source == "hll":
+        return hll.viewer_counter.count_multi(context_ids)
+
+    try:
+        with activity_service.retrying(attempts=4) as svc:
+            return svc.count_activity_multi(context_ids)
+    except TTransportException:
+        if source == "fallback":
+            g.stats.simple_event("liveupdate.activity.hll_fallback")
+            return hll.viewer_counter.count_multi(context_ids)
+        return None
+
+
+class _PhaseTimings(object):
+    """The total time an activity pass spends in each of its phases.
+
+    Each phase is also sent as a timer so the job's trend can be watched as
+    the number of live threads grows.
+
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = collections.Counter()
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        timer = g.stats.get_timer("liveupdate.activity." + phase)
+        timer.start()
+        start = time.time()
+        try:
+            yield
+        finally:
+            timer.stop()
+            with self.lock:
+                self.totals[phase] += time.time() - start
+
+    def summary(self):
+        return ", ".join("%s %.2fs" % (phase, seconds)
+                         for phase, seconds in sorted(self.totals.iteritems()))
+
+
+def _fetch_activity(chunk, activity_service, view_counts_query, timings):
+    with timings.timed("fetch"):
+        context_ids = {ev._fullname: ev._id for ev in chunk}
+
+        infos = _count_activity(context_ids.keys(), activity_service)
+        if infos is None:
+            return None
+
+        return context_ids, infos, view_counts_query.result()
+
+
+def _submit_fetch(chunk, timings):
+    if chunk is None:
+        return None
+
+    # the fetch runs without this thread's pylons context, so anything it
+    # needs from `c` is passed in and the view counts query (itself
+    # asynchronous) is started here.
+    activity_service = c.activity_service
+    view_countable = [ev._fullname for ev in chunk
+                      if ev._date >= g.liveupdate_min_date_viewcounts]
+    view_counts_query = ViewCountsQuery.execute_async(view_countable)
+    return fanout.submit(
+        "activity_fetch",
+        lambda: _fetch_activity(
+            chunk, activity_service, view_counts_query, timings),
+    )
+
+
+def _write_activity(infos_by_event, timings):
+    with timings.timed("write"):
+        counts = {event_id: info.count
+                  for event_id, info in infos_by_event.iteritems()}
+        failures = LiveUpdateActivityHistoryByEvent.record_activity_multi(
+            counts)
+        for event_id, e in failures.iteritems():
+            g.log.warning("Failed to update activity history for %r: %s",
+                          event_id, e)
+
+        events, failures = LiveUpdateEvent.update_activity_multi(
+            {event_id: (info.count, info.is_fuzzed)
+             for event_id, info in infos_by_event.iteritems()})
+        for event_id, e in failures.iteritems():
+            g.log.warning("Failed to update event activity for %r: %s",
+                          event_id, e)
+        return events
+
+
+def _diff_active_events(stored, top):
+    """Compare the stored listing with a new list of the most active threads.
+
+    `stored` is a dict of fullname to viewer count and `top` a list of
+    (event id, count, fuzzed) tuples. Returns the entries of `top` that are
+    new or whose count changed and the ids of threads that dropped out.
+
+    """
+    prefix = LiveUpdateEvent.__name__ + "_"
+    new_ids = {event_id for event_id, count, fuzzed in top}
+    changed = [entry for entry in top
+               if stored.get(prefix + entry[0]) != entry[1]]
+    removed = [fullname[len(prefix):] for fullname in stored
+               if fullname[len(prefix):] not in new_ids]
+    return changed, removed
+
+
+def _update_active_events(top):
+    """Bring the "most active" listing in line with `top`.
+
+    Rewriting the whole listing each pass costs a full row of writes even
+    when little has changed, so usually only the threads that are new to
+    it, changed count or dropped out are written. Every
+    FULL_REPLACE_INTERVAL the listing is replaced outright instead, which
+    refreshes its TTL and repairs any drift.
+
+    """
+    query = get_active_events()
+
+    if not g.cache.get(ACTIVE_EVENTS_REPLACED_KEY):
+        top_events = [LiveUpdateEvent._activity_thing(*entry) for entry in top]
+        with CachedQueryMutator() as m:
+            m.replace(query, top_events, ttl=ACTIVE_EVENTS_TTL)
+        g.cache.set(ACTIVE_EVENTS_REPLACED_KEY, True,
+                    time=FULL_REPLACE_INTERVAL)
+        g.stats.simple_event("liveupdate.active_events.replaced")
+        return
+
+    query.fetch(force=True)
+    stored = {item[0]: item[1] for item in query.data}
+    changed, removed = _diff_active_events(stored, top)
+    if not changed and not removed:
+        g.stats.simple_event("liveupdate.active_events.unchanged")
+        return
+
+    with CachedQueryMutator() as m:
+        if changed:
+            m.insert(query, [LiveUpdateEvent._activity_thing(*entry)
+                             for entry in changed],
+                     ttl=ACTIVE_EVENTS_TTL)
+        if removed:
+            removed_events = [
+                LiveUpdateEvent._activity_thing(event_id, 0, False)
+                for event_id in removed]
+            m.delete(query, removed_events)
+    g.stats.simple_event("liveupdate.active_events.updated")
+
+
+def update_activity(shard=0, shard_count=1):
+    """Update the viewer counts of live threads.
+
+    The work is pipelined: while one chunk of threads' counts are being
+    written, the counts for the next chunk are fetched in the background.
+    Each chunk's writes are batched into a few mutations.
+
+    The live threads can be split between `shard_count` workers, each
+    passing its own `shard`. Every shard stores its most active threads
+    and shard 0 merges them into the "most active" listing, so the listing
+    is at most one pass behind for the other shards.
+
+    """
+    timings = _PhaseTimings()
     events = {}
     event_counts = collections.Counter()
 
-    query = (ev for ev in LiveUpdateEvent._all()
-             if ev.state == "live" and not ev.banned)
-    for chunk in utils.in_chunks(query, size=100):
-        context_ids = {ev._fullname: ev._id for ev in chunk}
+    with timings.timed("total"):
+        query = LiveUpdateLiveEventsIndex.get_events(shard, shard_count)
+        chunks = utils.in_chunks(query, size=100)
 
-        view_countable = [ev._fullname for ev in chunk
-                          if ev._date >= g.liveupdate_min_date_viewcounts]
-        view_counts_query = ViewCountsQuery.execute_async(view_countable)
+        pending_fetch = _submit_fetch(next(chunks, None), timings)
+        while pending_fetch:
+            fetched = pending_fetch.result()
+            pending_fetch = _submit_fetch(next(chunks, None), timings)
 
-        try:
-            with c.activity_service.retrying(attempts=4) as svc:
-                infos = svc.count_activity_multi(context_ids.keys())
-        except TTransportException:
-            continue
-
-        view_counts = view_counts_query.result()
-
-        for context_id, info in infos.iteritems():
-            event_id = context_ids[context_id]
-
-            try:
-                LiveUpdateActivityHistoryByEvent.record_activity(
-                    event_id, info.count)
-            except tdb_cassandra.TRANSIENT_EXCEPTIONS as e:
-                g.log.warning("Failed to update activity history for %r: %s",
-                              event_id, e)
-
-            try:
-                event = LiveUpdateEvent.update_activity(
-                    event_id, info.count, info.is_fuzzed)
-            except tdb_cassandra.TRANSIENT_EXCEPTIONS as e:
-                g.log.warning("Failed to update event activity for %r: %s",
-                              event_id, e)
-            else:
+            if fetched is None:
+                continue
+            context_ids, infos, view_counts = fetched
+
+            infos_by_event = {context_ids[context_id]: info
+                              for context_id, info in infos.iteritems()}
+            pending_write = fanout.submit(
+                "activity_write",
+                lambda: _write_activity(infos_by_event, timings))
+
+            # broadcasts are only put on the amqp worker's queue here, and
+            # are sent in the background.
+            with timings.timed("broadcast"):
+                for context_id, info in infos.iteritems():
+                    websockets.send_broadcast(
+                        "/live/" + context_ids[context_id],
+                        type="activity",
+                        payload={
+                            "count": info.count,
+                            "fuzzed": info.is_fuzzed,
+                            "total_views": view_counts.get(context_id),
+                        },
+                    )
+
+            # the writes are timed as "write" where they run, this is only
+            # how long this thread is held up waiting for them.
+            with timings.timed("write_wait"):
+                chunk_events = pending_write.result()
+
+            for event_id, event in chunk_events.iteritems():
                 events[event_id] = event
-                event_counts[event_id] = info.count
-
-            websockets.send_broadcast(
-                "/live/" + event_id,
-                type="activity",
-                payload={
-                    "count": info.count,
-                    "fuzzed": info.is_fuzzed,
-                    "total_views": view_counts.get(context_id),
-                },
-            )
-
-    top_event_ids = [event_id for event_id, count in event_counts.most_common(1000)]
-    top_events = [events[event_id] for event_id in top_event_ids]
-    query_ttl = datetime.timedelta(days=3)
-    with CachedQueryMutator() as m:
-        m.replace(get_active_events(), top_events, ttl=query_ttl)
+                event_counts[event_id] = infos_by_event[event_id].count
+
+        with timings.timed("listing"):
+            top = [(event_id, count, events[event_id].active_visitors_fuzzed)
+                   for event_id, count
+                   in event_counts.most_common(MAX_ACTIVE_EVENTS)]
+
+            if shard_count > 1:
+                LiveUpdateActiveEventsByShard.set_top(shard, shard_count, top)
+                if shard == 0:
+                    top = LiveUpdateActiveEventsByShard.get_top(
+                        shard_count, limit=MAX_ACTIVE_EVENTS)
+
+            if shard_count == 1 or shard == 0:
+                _update_active_events(top)
+
+        # ensure that all the amqp messages we've put on the worker's queue
+        # are sent before we allow this script to exit.
+        with timings.timed("amqp_flush"):
+            amqp.worker.join()
+
+    g.log.info("update_activity: %d threads in shard %d/%d (%s)",
+               len(event_counts), shard, shard_count, timings.summary())
+
+
+def run_daemon(shard=0, shard_count=1, interval=DAEMON_INTERVAL,
+               jitter=DAEMON_JITTER):
+    """Run update_activity every `interval` seconds until told to stop.
+
+    This keeps the app and its connection pools warm between passes rather
+    than paying for a fresh process each time. SIGTERM and SIGINT finish the
+    current pass before exiting. The time between the starts of passes is
+    sent as the liveupdate.activity.period timer; if it's much more than
+    `interval`, passes are taking too long.
+
+    """
+    stopping = threading.Event()
+
+    def _stop(signum, frame):
+        g.log.info("activity daemon stopping after the current pass")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    period_timer = None
+    next_run = time.time()
+    while not stopping.is_set():
+        if period_timer:
+            period_timer.stop()
+        period_timer = g.stats.get_timer("liveupdate.activity.period")
+        period_timer.start()
+
+        started = time.time()
+        g.reset_caches()
+        try:
+            update_activity(shard, shard_count)
+        except Exception:
+            g.log.exception("activity pass failed")
+
+        elapsed = time.time() - started
+        if elapsed > interval:
+            g.log.warning("activity pass took %.0fs, longer than its %ds "
+                          "interval", elapsed, interval)
 
-    # ensure that all the amqp messages we've put on the worker's queue are
-    # sent before we allow this script to exit.
-    amqp.worker.join()
+        # if a pass overran, start the next one straight away rather than
+        # trying to catch up on the ones that were missed
+        next_run = max(next_run + interval, time.time())
+        delay = next_run - time.time() + random.uniform(0, jitter)
+        stopping.wait(delay)
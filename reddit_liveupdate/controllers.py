@@ -1,15 +1,14 @@
 import collections
 import hashlib
 import json
-import os
 import re
+import time
 import uuid
 
 from pylons import request, response
 from pylons import tmpl_context as c
 from pylons import app_globals as g
 from pylons.i18n import _
-from thrift.transport.TTransport import TTransportException
 
 from r2.config.extensions import is_api
 from r2.controllers import add_controller
@@ -27,7 +26,6 @@ from r2.controllers.listingcontroller import (
 from r2.lib import hooks, baseplate_integration
 from r2.lib.base import BaseController, abort
 from r2.lib.db import tdb_cassandra
-from r2.lib.filters import safemarkdown
 from r2.lib.validator import (
     nop,
     validate,
@@ -66,19 +64,27 @@ from r2.lib.errors import errors
 from r2.lib.pages import AdminPage, PaneStack, Wrapped, RedditError, Reddit
 from r2.lib import amqp, geoip
 
-from reddit_liveupdate import pages, queries
+from reddit_liveupdate import fanout, hll, pages, pixel, queries
+from reddit_liveupdate.activity import get_activity_series
 from reddit_liveupdate.contrib import iso3166
-from reddit_liveupdate.discussions import get_discussions
+from reddit_liveupdate.discussions import (
+    get_discussion_links,
+    get_discussions,
+)
 from reddit_liveupdate.media_embeds import get_live_media_embed
 from reddit_liveupdate.models import (
     InviteNotFoundError,
     LiveUpdate,
+    LiveUpdateChangesByEvent,
     LiveUpdateEvent,
+    LiveUpdateHeadQuery,
     LiveUpdateStream,
     LiveUpdateContributorInvitesByEvent,
     LiveUpdateReportsByAccount,
     LiveUpdateReportsByEvent,
+    LiveUpdateTombstonesByEvent,
     FocusQuery,
+    TombstoneSkippingQuery,
 )
 from reddit_liveupdate.permissions import ContributorPermissionSet
 from reddit_liveupdate.utils import send_event_broadcast
@@ -87,6 +93,7 @@ from reddit_liveupdate.validators import (
     EVENT_CONFIGURATION_VALIDATORS,
     VLiveUpdate,
     VLiveUpdateContributorWithPermission,
+    VLiveUpdateCursor,
     VLiveUpdateEvent,
     VLiveUpdateEventUrl,
     VLiveUpdatePermissions,
@@ -111,11 +118,41 @@ see the [reports page](/live/reported) for more information.
 """
 HAPPENING_NOW_KEY = 'live_happening_now'
 
+# the most changes returned by a single request to /live/{thread}/since
+MAX_CHANGES_SINCE = 100
+
 
 def _broadcast(type, payload):
     send_event_broadcast(c.liveupdate_event._id, type, payload)
 
 
+def _parse_etags(header):
+    etags = set()
+    for etag in header.split(","):
+        etag = etag.strip()
+        if etag.startswith("W/"):
+            etag = etag[2:]
+        etags.add(etag)
+    return etags
+
+
+def check_etag(*components):
+    """Set an ETag derived from components and abort if the client has it.
+
+    The components must capture everything the response depends on.
+
+    """
+    key = "\0".join(unicode(component) for component in components)
+    etag = '"%s"' % hashlib.md5(key.encode("utf-8")).hexdigest()
+    response.headers["ETag"] = etag
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        etags = _parse_etags(if_none_match)
+        if etag in etags or "*" in etags:
+            abort(304, "not modified")
+
+
 def close_event(event):
     """Close a liveupdate event"""
     event.state = "complete"
@@ -199,33 +236,27 @@ class LiveUpdateInvitedContributorBuilder(LiveUpdateContributorBuilder):
 
 
 def record_activity(event_id):
-    """Record the visit in the activity service."""
-    event_id = event_id[:50]  # some very simple poor-man's validation
-    user_agent = request.user_agent or ''
-    user_id = hashlib.sha1(request.ip + user_agent).hexdigest()
+    """Record the visit in the activity service.
+
+    Visits are buffered and sent in batches by the pixel's BatchSender.
+
+    """
+    user_id = pixel.make_visitor_id(request.ip, request.user_agent)
+    event_context_id = pixel.make_context_id(event_id)
+    sender = pixel.get_sender(g._current_obj())
 
     if c.activity_service:
-        event_context_id = "LiveUpdateEvent_" + event_id
-        try:
-            c.activity_service.record_activity(event_context_id, user_id)
-        except TTransportException:
-            pass
+        batch = pixel.activity_buffer.add(event_context_id, user_id)
+        if batch:
+            sender.send(batch)
+
+    if g.live_config.get("liveupdate_hll_counting", False):
+        if hll.viewer_counter.add(event_context_id, user_id):
+            sender.submit(hll.viewer_counter.flush)
 
 
 @add_controller
 class LiveUpdatePixelController(BaseController):
-    def __init__(self, *args, **kwargs):
-        self._pixel_data = None
-        BaseController.__init__(self, *args, **kwargs)
-
-    @property
-    def _pixel_contents(self):
-        if not self._pixel_data:
-            with open(os.path.join(g.paths["root"],
-                                   "public/static/pixel.png")) as f:
-                self._pixel_data = f.read()
-        return self._pixel_data
-
     # this decorator takes **kwargs which routes treats specially and throws
     # every routing variable it could think of at the endpoint, so this means
     # GET_pixel then has to take **kwargs too just to appease it. annoying.
@@ -238,11 +269,9 @@ class LiveUpdatePixelController(BaseController):
                 "liveupdatepixelcontroller.GET_pixel"):
             record_activity(event)
 
-        response.content_type = "image/png"
-        response.headers["Cache-Control"] = "no-cache, max-age=0"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "Thu, 01 Jan 1970 00:00:00 GMT"
-        return self._pixel_contents
+        for name, value in pixel.PIXEL_HEADERS:
+            response.headers[name] = value
+        return pixel.get_pixel_contents()
 
 
 @add_controller
@@ -322,32 +351,94 @@ class LiveUpdateController(RedditController):
         # correct activity count for short lived connections.
         record_activity(c.liveupdate_event._id)
 
+        if is_api():
+            check_etag(
+                "listing",
+                c.liveupdate_event._id,
+                c.liveupdate_event.stream_token,
+                c.liveupdate_permissions.dumps(),
+                c.user._id36 if c.user_is_loggedin else "",
+                c.render_style,
+                request.query_string,
+                pages.BODY_HTML_VERSION,
+            )
+
+        # the parts of the page that don't depend on the listing are fetched
+        # concurrently while the listing is built in this thread. the sidebar
+        # is optional, so if its parts are slow or broken it's left empty.
+        # a slow call outlives the request, so the calls only get what they
+        # need from it captured up front and never touch `c` themselves.
+        sidebar_timeout = g.live_config.get("liveupdate_sidebar_timeout", 0.5)
+        event = c.liveupdate_event
+
+        discussions_call = contributors_call = report_call = None
+        if not is_embed:
+            discussions_call = fanout.submit(
+                "discussions",
+                lambda: get_discussion_links(
+                    event,
+                    limit=pages.LiveUpdateOtherDiscussions.max_links + 1,
+                ),
+                timeout=sidebar_timeout,
+                fallback=None,
+            )
+            contributors_call = fanout.submit(
+                "contributors",
+                lambda: pages.get_contributor_accounts(event),
+                timeout=sidebar_timeout,
+                fallback=[],
+            )
+
+        if c.user_is_loggedin:
+            user = c.user
+            report_call = fanout.submit(
+                "report",
+                lambda: LiveUpdateReportsByAccount.get_report(user, event),
+                timeout=sidebar_timeout,
+                fallback=None,
+            )
+
         reverse = False
         if before:
             reverse = True
             after = before
 
-        query = LiveUpdateStream.query([c.liveupdate_event._id],
-                                       count=num, reverse=reverse)
-        if after:
-            query.column_start = after
-        builder = LiveUpdateBuilder(query=query, skip=True,
-                                    reverse=reverse, num=num,
-                                    count=count)
-        listing = pages.LiveUpdateListing(builder)
-        wrapped_listing = listing.listing()
+        with fanout.timed("listing"):
+            if after:
+                query = LiveUpdateStream.query_event(
+                    c.liveupdate_event, count=num, reverse=reverse)
+                query.column_start = after
+            else:
+                query = LiveUpdateHeadQuery(c.liveupdate_event)
 
-        if c.user_is_loggedin:
-            report_type = LiveUpdateReportsByAccount.get_report(
-                c.user, c.liveupdate_event)
-        else:
-            report_type = None
+            tombstones = LiveUpdateTombstonesByEvent.get_tombstones(
+                c.liveupdate_event,
+                after=after,
+                reverse=reverse,
+            )
+            query = TombstoneSkippingQuery(query, tombstones)
+
+            builder = LiveUpdateBuilder(query=query, skip=True,
+                                        reverse=reverse, num=num,
+                                        count=count)
+            listing = pages.LiveUpdateListing(builder)
+            wrapped_listing = listing.listing()
+
+        discussions = None
+        discussion_links = (discussions_call.result()
+                            if discussions_call else None)
+        if discussion_links is not None:
+            discussions = pages.LiveUpdateOtherDiscussions(
+                event, discussion_links)
 
         content = pages.LiveUpdateEventApp(
             event=c.liveupdate_event,
             listing=wrapped_listing,
             show_sidebar=not is_embed,
-            report_type=report_type,
+            report_type=report_call.result() if report_call else None,
+            contributors=(contributors_call.result()
+                          if contributors_call else []),
+            discussions=discussions,
         )
 
         view_count = None
@@ -457,6 +548,17 @@ class LiveUpdateController(RedditController):
         if not is_api():
             self.abort404()
 
+        # the websocket url in the response expires, so make sure clients
+        # get a fresh one at least hourly even if nothing else changed.
+        check_etag(
+            "about",
+            c.liveupdate_event._id,
+            sorted(c.liveupdate_event._t.iteritems()),
+            c.render_style,
+            request.query_string,
+            int(time.time()) // 3600,
+        )
+
         content = Wrapped(c.liveupdate_event)
 
         if c.liveupdate_event._date >= g.liveupdate_min_date_viewcounts:
@@ -465,6 +567,112 @@ class LiveUpdateController(RedditController):
 
         return pages.LiveUpdateEventPage(content=content).render()
 
+    @require_oauth2_scope("read")
+    @validate(
+        resolution=VOneOf("resolution", ("minute", "hour", "day"),
+                          default="hour"),
+        start=VInt("start", min=0),
+        end=VInt("end", min=0),
+    )
+    @api_doc(
+        section=api_section.live,
+        uri="/live/{thread}/activity",
+    )
+    def GET_activity(self, resolution, start, end):
+        """Get the viewer count history of the live thread.
+
+        `start` and `end` are epoch timestamps and default to the day before
+        now. Each point in the returned series covers one `resolution` sized
+        bucket and holds the minimum, maximum and average viewer counts seen
+        in it. Minute resolution is only available for the last week.
+
+        """
+        if not is_api():
+            self.abort404()
+
+        now = int(time.time())
+        end = min(end or now, now)
+        if start is None:
+            start = end - 24 * 60 * 60
+
+        series = get_activity_series(
+            c.liveupdate_event._id, resolution, start, end)
+
+        response.content_type = "application/json"
+        response.headers["Cache-Control"] = "public, max-age=60"
+        return json.dumps({
+            "resolution": resolution,
+            "series": series,
+        })
+
+    @require_oauth2_scope("read")
+    @validate(
+        cursor=VLiveUpdateCursor("cursor"),
+    )
+    @api_doc(
+        section=api_section.live,
+        uri="/live/{thread}/since",
+    )
+    def GET_since(self, cursor):
+        """Get the changes made to the thread since a cursor.
+
+        This is meant for clients catching up after losing their websocket
+        connection. `updates` holds updates posted since the cursor and
+        `changes` the other messages the websocket would have delivered
+        (`delete`, `strike` and `embeds_ready`), both oldest first.
+
+        The first request may pass the fullname of the newest update the
+        client has as its cursor. Pass the returned `cursor` to the next
+        request. If `more` is true, there are more changes to fetch right
+        away. If `reset` is true, the cursor is too old to catch up from and
+        the listing should be fetched again instead. An invalid cursor is
+        rejected with a 400.
+
+        """
+        if not is_api():
+            self.abort404()
+
+        if (errors.INVALID_OPTION, "cursor") in c.errors:
+            abort(400)
+
+        cursor, is_update = cursor
+
+        result = {
+            "updates": [],
+            "changes": [],
+            "more": False,
+            "reset": False,
+        }
+
+        if not cursor or LiveUpdateChangesByEvent.is_expired(cursor):
+            result["reset"] = bool(cursor)
+            result["cursor"] = str(uuid.uuid1())
+        else:
+            changes = LiveUpdateChangesByEvent.get_since(
+                c.liveupdate_event._id, cursor, count=MAX_CHANGES_SINCE + 1)
+            result["more"] = len(changes) > MAX_CHANGES_SINCE
+            changes = changes[:MAX_CHANGES_SINCE]
+
+            for change_id, type, payload in changes:
+                if type == "update":
+                    # an update's journal entry is written just after its id
+                    # is made, so a client that gave the update as its
+                    # cursor would otherwise get it (and any older ones
+                    # journaled at the same time) back again.
+                    update_id = uuid.UUID(payload["data"]["id"])
+                    if is_update and update_id.time <= cursor.time:
+                        continue
+                    result["updates"].append(payload)
+                else:
+                    result["changes"].append({"type": type, "payload": payload})
+
+            last_id = changes[-1][0] if changes else cursor
+            result["cursor"] = str(last_id)
+
+        response.content_type = "application/json"
+        response.headers["Cache-Control"] = "private, no-cache"
+        return json.dumps(result)
+
     @require_oauth2_scope("read")
     @base_listing
     @api_doc(
@@ -582,10 +790,10 @@ class LiveUpdateController(RedditController):
             changes["title"] = title
         if description != c.liveupdate_event.description:
             changes["description"] = description
-            changes["description_html"] = safemarkdown(description, nofollow=True) or ""
+            changes["description_html"] = pages.render_event_markdown(description)
         if resources != c.liveupdate_event.resources:
             changes["resources"] = resources
-            changes["resources_html"] = safemarkdown(resources, nofollow=True) or ""
+            changes["resources_html"] = pages.render_event_markdown(resources)
         if nsfw != c.liveupdate_event.nsfw:
             changes["nsfw"] = nsfw
 
@@ -596,6 +804,9 @@ class LiveUpdateController(RedditController):
         c.liveupdate_event.description = description
         c.liveupdate_event.resources = resources
         c.liveupdate_event.nsfw = nsfw
+        for attr in ("description_html", "resources_html"):
+            if attr in changes:
+                setattr(c.liveupdate_event, attr, changes[attr])
         c.liveupdate_event._commit()
 
         amqp.add_item("liveupdate_event_edited", json.dumps({
@@ -899,8 +1110,12 @@ class LiveUpdateController(RedditController):
         })
 
         hooks.get_hook("liveupdate.update").call(update=update)
+        pages.prerender_update_body(update)
 
-        LiveUpdateStream.add_update(c.liveupdate_event, update)
+        LiveUpdateStream.add_update(
+            c.liveupdate_event, update,
+            event_changes=c.liveupdate_event.update_posted_changes(update),
+        )
 
         # tell the world about our new update
         builder = LiveUpdateBuilder(None)
@@ -945,8 +1160,14 @@ class LiveUpdateController(RedditController):
                 (c.user_is_loggedin and update.author_id == c.user._id)):
             abort(403)
 
+        event_changes = None
+        if not update.deleted:
+            event_changes = c.liveupdate_event.update_deleted_changes(update)
         update.deleted = True
-        LiveUpdateStream.add_update(c.liveupdate_event, update)
+        LiveUpdateStream.add_update(
+            c.liveupdate_event, update, event_changes=event_changes)
+        LiveUpdateTombstonesByEvent.add(
+            c.liveupdate_event, update, reason="deleted")
         liveupdate_events.update_event(update, context=c, request=request)
 
         _broadcast(type="delete", payload=update._fullname)
@@ -1064,6 +1285,7 @@ class LiveUpdateController(RedditController):
         c.liveupdate_event.banned = False
         c.liveupdate_event._commit()
 
+        queries.approve_event(c.liveupdate_event)
         queries.unreport_event(c.liveupdate_event)
         liveupdate_events.ban_event(context=c, request=request)
 
@@ -1076,6 +1298,7 @@ class LiveUpdateController(RedditController):
         c.liveupdate_event.banned_by = c.user.name
         c.liveupdate_event._commit()
 
+        queries.ban_event(c.liveupdate_event)
         queries.unreport_event(c.liveupdate_event)
         liveupdate_events.ban_event(context=c, request=request)
 
@@ -1276,9 +1499,13 @@ class LiveUpdateEventsController(RedditController):
             id=None,
             title=title,
             description=description,
+            description_html=pages.render_event_markdown(description),
             resources=resources,
+            resources_html=pages.render_event_markdown(resources),
             banned=c.user._spam,
             nsfw=nsfw,
+            stream_bucketed=g.live_config.get(
+                "liveupdate_bucket_new_streams", False),
         )
         event.add_contributor(c.user, ContributorPermissionSet.SUPERUSER)
         queries.create_event(event)
@@ -25,9 +25,7 @@ def _get_related_link_ids(event_id):
     return [link._fullname for link in links]
 
 
-def get_discussions(event, limit, show_hidden=False):
-    """Return a builder providing Links that point at the given live thread."""
-
+def _make_discussion_filter(event, show_hidden):
     hidden_links = event.hidden_discussions
     def _keep_discussion_link(link):
         if link._spam or link._deleted:
@@ -53,11 +51,30 @@ def get_discussions(event, limit, show_hidden=False):
             return False
 
         return True
+    return _keep_discussion_link
 
+
+def get_discussions(event, limit, show_hidden=False):
+    """Return a builder providing Links that point at the given live thread."""
     link_fullnames = _get_related_link_ids(event._id)
     link_fullnames = link_fullnames[:limit]
     return IDBuilder(
         query=link_fullnames,
         skip=True,
-        keep_fn=_keep_discussion_link,
+        keep_fn=_make_discussion_filter(event, show_hidden),
     )
+
+
+def get_discussion_links(event, limit):
+    """Return the unhidden Links that point at the given live thread.
+
+    Unlike get_discussions, the links aren't wrapped for the current user,
+    so this doesn't use the request's context and can be called from
+    another thread.
+
+    """
+    keep_fn = _make_discussion_filter(event, show_hidden=False)
+    link_fullnames = _get_related_link_ids(event._id)[:limit]
+    links = Link._by_fullname(link_fullnames, data=True,
+                              return_dict=False, ignore_missing=True)
+    return [link for link in links if keep_fn(link)]
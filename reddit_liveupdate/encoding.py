@@ -0,0 +1,120 @@
+"""Compact serialization of LiveUpdate data for LiveUpdateStream columns.
+
+Originally each column held a plain JSON object, which repeats every key name
+in every column of a thread. The compact format replaces key names with small
+integer field ids and leaves out values equal to the defaults.
+
+Because the column family validates its values as UTF-8, the encoding stays
+text: a single version character followed by a flat JSON array of
+alternating field ids and values. Legacy JSON objects always start with "{"
+so they can still be read.
+
+Version 2 adds a one character header of boolean flags between the version
+and the array so that the flags consulted by listings (deleted, spam,
+stricken) can be read without parsing the rest of the column.
+
+"""
+import json
+
+
+VERSION_1 = u"\x01"
+VERSION_2 = u"\x02"
+CURRENT_VERSION = VERSION_2
+
+# ids must never be renumbered or reused. new fields go on the end. fields
+# that aren't in this table are stored under their name instead.
+FIELD_IDS = {
+    "author_id": 1,
+    "body": 2,
+    "_spam": 3,
+    "deleted": 4,
+    "stricken": 5,
+    "media_objects": 6,
+    "mobile_objects": 7,
+    "body_html": 8,
+    "body_html_version": 9,
+}
+FIELD_NAMES = {id: name for name, id in FIELD_IDS.iteritems()}
+
+# fields stored as bits of the version 2 flags header rather than in the array
+FLAG_BITS = (
+    ("deleted", 1),
+    ("_spam", 2),
+    ("stricken", 4),
+)
+FLAG_FIELDS = frozenset(name for name, bit in FLAG_BITS)
+_FLAGS_BASE = ord("0")
+
+_SEPARATORS = (",", ":")
+
+
+class UnknownEncodingError(ValueError):
+    pass
+
+
+def encode(data, defaults=None):
+    """Serialize a dict of update data in the current compact format."""
+    defaults = defaults or {}
+
+    flags = 0
+    for name, bit in FLAG_BITS:
+        if data.get(name):
+            flags |= bit
+
+    fields = []
+    for name, value in data.iteritems():
+        if name in FLAG_FIELDS:
+            continue
+        if name in defaults and defaults[name] == value:
+            continue
+        fields.append(FIELD_IDS.get(name, name))
+        fields.append(value)
+
+    return (CURRENT_VERSION +
+            unichr(_FLAGS_BASE + flags) +
+            json.dumps(fields, separators=_SEPARATORS))
+
+
+def _decode_fields(serialized):
+    fields = json.loads(serialized)
+    return {FIELD_NAMES.get(k, k): v for k, v in zip(fields[::2], fields[1::2])}
+
+
+def _decode_flag_bits(char):
+    bits = ord(char) - _FLAGS_BASE
+    return {name: bool(bits & bit) for name, bit in FLAG_BITS}
+
+
+def decode(value):
+    """Deserialize column data written in any known format."""
+    if not value:
+        raise UnknownEncodingError("empty column value")
+
+    version = value[0]
+    if version == u"{":
+        return json.loads(value)
+    elif version == VERSION_1:
+        return _decode_fields(value[1:])
+    elif version == VERSION_2:
+        data = _decode_fields(value[2:])
+        for name, is_set in _decode_flag_bits(value[1]).iteritems():
+            if is_set:
+                data[name] = True
+        return data
+    raise UnknownEncodingError("unknown column format %r" % version)
+
+
+def decode_flags(value):
+    """Return the flag fields of a column without decoding the rest of it.
+
+    Returns None if the column is in a format without a flags header, in
+    which case the caller has to fall back to a full decode.
+
+    """
+    if value and value[0] == VERSION_2:
+        return _decode_flag_bits(value[1])
+    return None
+
+
+def is_current(value):
+    return bool(value) and value[0] == CURRENT_VERSION
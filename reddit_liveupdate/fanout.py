@@ -0,0 +1,123 @@
+"""Run the independent lookups of a request concurrently.
+
+Pages like the thread listing need several unrelated pieces of data and
+fetching them one after another makes the page as slow as all of them put
+together. `submit` starts a lookup on a shared thread pool and returns a
+handle whose `result` waits for it, so a page can start everything it needs
+up front and only wait as long as the slowest one.
+
+The Pylons globals are thread-local. Only the app globals (`g`) are pushed
+onto them in the worker thread for the duration of the call. A call that
+times out keeps running after the request it was made for has finished, so
+calls must not use `c`, `request` or `response`; whatever they need from
+the request is captured before they're submitted.
+
+"""
+import contextlib
+import threading
+
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+import pylons
+from pylons import app_globals as g
+
+
+POOL_SIZE = 16
+
+_CONTEXT_PROXIES = (
+    pylons.app_globals,
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    # created lazily so that the threads are started in the process that
+    # serves requests rather than in a parent that forks it.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(POOL_SIZE)
+        return _pool
+
+
+def _capture_context():
+    context = []
+    for proxy in _CONTEXT_PROXIES:
+        try:
+            context.append((proxy, proxy._current_obj()))
+        except TypeError:
+            # nothing is registered with this proxy in the current thread
+            pass
+    return context
+
+
+@contextlib.contextmanager
+def timed(name):
+    timer = g.stats.get_timer("liveupdate.fanout." + name)
+    timer.start()
+    try:
+        yield
+    finally:
+        timer.stop()
+
+
+def _call_in_context(context, name, fn):
+    for proxy, obj in context:
+        proxy._push_object(obj)
+
+    try:
+        with timed(name):
+            return fn()
+    finally:
+        for proxy, obj in reversed(context):
+            proxy._pop_object(obj)
+
+
+_NO_FALLBACK = object()
+
+
+class PendingCall(object):
+    def __init__(self, name, async_result, timeout, fallback):
+        self.name = name
+        self.async_result = async_result
+        self.timeout = timeout
+        self.fallback = fallback
+
+    def result(self):
+        """Wait for and return the result of the call.
+
+        If the call fails or takes longer than its timeout the fallback is
+        returned instead, or the error is raised if there is no fallback.
+
+        """
+        try:
+            return self.async_result.get(self.timeout)
+        except TimeoutError:
+            if self.fallback is _NO_FALLBACK:
+                raise
+            g.log.warning("%s timed out after %ss", self.name, self.timeout)
+            g.stats.simple_event("liveupdate.fanout.%s.timeout" % self.name)
+            return self.fallback
+        except Exception:
+            if self.fallback is _NO_FALLBACK:
+                raise
+            g.log.exception("%s failed", self.name)
+            g.stats.simple_event("liveupdate.fanout.%s.error" % self.name)
+            return self.fallback
+
+
+def submit(name, fn, timeout=None, fallback=_NO_FALLBACK):
+    """Start calling `fn` with no arguments in the thread pool.
+
+    `name` identifies the call in timers and logs. If `fallback` is given,
+    `result` returns it rather than raising when the call fails or times
+    out, which lets optional parts of a page degrade to nothing.
+
+    """
+    context = _capture_context()
+    async_result = _get_pool().apply_async(
+        _call_in_context, (context, name, fn))
+    return PendingCall(name, async_result, timeout, fallback)
@@ -0,0 +1,205 @@
+"""Approximate counting of each live thread's viewers with HyperLogLog.
+
+This is an in-plugin alternative to the activity service's visitor counts.
+Hits recorded by the pixel are added to a HyperLogLog sketch for the
+thread and the current minute. Sketches are small and fixed size no matter
+how many visitors a thread has, and they can be merged, so the number of
+viewers over the last ACTIVITY_WINDOW is estimated by merging that many
+minutes of sketches.
+
+Each process accumulates sketches locally and periodically merges them into
+a shared store (memcached in production). Merging takes the maximum of
+each register, so it's idempotent: because processes always write their
+whole sketch for a minute rather than what's changed, a write lost to a
+concurrent one is repaired by that process's next flush.
+
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+
+from pylons import app_globals as g
+
+
+# 2 ** PRECISION registers per sketch, for a standard error of about 2.3%
+PRECISION = 11
+
+# the length of the time slots sketches are kept for and how many of them
+# make up the window viewers are counted over
+SLOT_SECONDS = 60
+ACTIVITY_WINDOW = 15 * 60
+
+# counts below this are fuzzed, like those from the activity service
+FUZZ_THRESHOLD = 100
+
+
+class HyperLogLog(object):
+    def __init__(self, registers=None, precision=PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            registers = bytearray(self.size)
+        self.registers = bytearray(registers)
+        assert len(self.registers) == self.size
+
+    def add(self, value):
+        hashed = int(hashlib.sha1(value).hexdigest()[:16], 16)
+        index = hashed >> (64 - self.precision)
+        remainder_bits = 64 - self.precision
+        remainder = hashed & ((1 << remainder_bits) - 1)
+        rank = remainder_bits - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        registers = self.registers
+        for i, value in enumerate(other.registers):
+            if value > registers[i]:
+                registers[i] = value
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = (alpha * self.size ** 2 /
+                    sum(2.0 ** -value for value in self.registers))
+
+        if estimate <= 2.5 * self.size:
+            zeros = self.registers.count(b"\x00")
+            if zeros:
+                # small range correction (linear counting)
+                estimate = self.size * math.log(float(self.size) / zeros)
+
+        return int(round(estimate))
+
+    def serialize(self):
+        return str(self.registers)
+
+    @classmethod
+    def deserialize(cls, value):
+        return cls(registers=value)
+
+
+class InMemorySketchStore(object):
+    """A process-local stand-in for the shared sketch store."""
+    def __init__(self):
+        self.values = {}
+
+    def get_multi(self, keys):
+        return {key: self.values[key] for key in keys if key in self.values}
+
+    def set_multi(self, values, time):
+        self.values.update(values)
+
+
+class MemcacheSketchStore(object):
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_multi(self, keys):
+        return self.cache.get_multi(keys)
+
+    def set_multi(self, values, time):
+        self.cache.set_multi(values, time=time)
+
+
+class ViewerCount(object):
+    """A viewer count with the same attributes as the service's counts."""
+    def __init__(self, count, is_fuzzed):
+        self.count = count
+        self.is_fuzzed = is_fuzzed
+
+
+def _fuzz(count):
+    if count == 0:
+        return ViewerCount(0, is_fuzzed=True)
+    if count >= FUZZ_THRESHOLD:
+        return ViewerCount(count, is_fuzzed=False)
+    return ViewerCount(max(1, count + random.randint(-5, 5)), is_fuzzed=True)
+
+
+class ViewerCounter(object):
+    flush_interval = 5
+
+    def __init__(self, store=None, slot_seconds=SLOT_SECONDS,
+                 window=ACTIVITY_WINDOW):
+        self.store = store
+        self.slot_seconds = slot_seconds
+        self.window = window
+        self.lock = threading.Lock()
+        self.local = {}
+        self.last_flush = time.time()
+
+    def _get_store(self):
+        # hits are added outside of pylons by the pixel fast path, so the
+        # default store is only looked up when it's needed.
+        return self.store or MemcacheSketchStore(g.memcache)
+
+    def _slot(self, now):
+        return int(now) // self.slot_seconds
+
+    def _key(self, context_id, slot):
+        return "liveupdate_hll_%s_%d" % (context_id, slot)
+
+    def add(self, context_id, visitor_id, now=None):
+        """Count a hit in this process's sketch for the current slot.
+
+        Returns True if it's time for the caller to arrange a flush.
+
+        """
+        now = now or time.time()
+        key = (context_id, self._slot(now))
+        with self.lock:
+            sketch = self.local.get(key)
+            if sketch is None:
+                sketch = self.local[key] = HyperLogLog()
+            sketch.add(visitor_id)
+
+            if now - self.last_flush >= self.flush_interval:
+                self.last_flush = now
+                return True
+        return False
+
+    def flush(self, now=None):
+        """Merge this process's sketches into the shared store."""
+        current_slot = self._slot(now or time.time())
+        with self.lock:
+            local = self.local
+            # keep the current slot's sketch so that later flushes write the
+            # whole slot again. older slots won't get any more hits.
+            self.local = {key: sketch for key, sketch in local.iteritems()
+                          if key[1] >= current_slot}
+
+        if not local:
+            return
+
+        keys = {self._key(context_id, slot): sketch
+                for (context_id, slot), sketch in local.iteritems()}
+        store = self._get_store()
+        stored = store.get_multi(keys.keys())
+        for key, value in stored.iteritems():
+            keys[key].merge(HyperLogLog.deserialize(value))
+
+        store.set_multi(
+            {key: sketch.serialize() for key, sketch in keys.iteritems()},
+            time=self.window + self.slot_seconds,
+        )
+
+    def count_multi(self, context_ids, now=None):
+        """Return a dict of context id to ViewerCount over the window."""
+        current_slot = self._slot(now or time.time())
+        slots = range(current_slot - self.window // self.slot_seconds + 1,
+                      current_slot + 1)
+        keys = {self._key(context_id, slot): context_id
+                for context_id in context_ids for slot in slots}
+        stored = self._get_store().get_multi(keys.keys())
+
+        sketches = {context_id: HyperLogLog() for context_id in context_ids}
+        for key, value in stored.iteritems():
+            sketches[keys[key]].merge(HyperLogLog.deserialize(value))
+
+        return {context_id: _fuzz(sketch.count())
+                for context_id, sketch in sketches.iteritems()}
+
+
+viewer_counter = ViewerCounter()
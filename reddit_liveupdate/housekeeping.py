@@ -3,10 +3,13 @@ import datetime
 import pytz
 
 from pylons import app_globals as g
-from pycassa.cassandra.ttypes import NotFoundException
 
 from reddit_liveupdate.controllers import close_event
-from reddit_liveupdate.models import LiveUpdateEvent, LiveUpdateStream
+from reddit_liveupdate.models import (
+    LiveUpdateEvent,
+    LiveUpdateLiveEventsIndex,
+    LiveUpdateStream,
+)
 
 
 # how long a live thread must go without being updated before we consider it
@@ -14,6 +17,14 @@ from reddit_liveupdate.models import LiveUpdateEvent, LiveUpdateStream
 DERELICTION_THRESHOLD = datetime.timedelta(days=30)
 
 
+def _get_last_modified_from_stream(event):
+    # fallback for events that haven't had last_update_at backfilled
+    updates = list(LiveUpdateStream.query_event(event, count=1))
+    if not updates:
+        return event._date
+    return updates[0]._date
+
+
 def close_abandoned_threads():
     """Find live threads that are abandoned and close them.
 
@@ -25,20 +36,49 @@ def close_abandoned_threads():
     now = datetime.datetime.now(pytz.UTC)
     horizon = now - DERELICTION_THRESHOLD
 
-    for event in LiveUpdateEvent._all():
-        if event.state != "live" or event.banned:
-            continue
-
-        try:
-            columns = LiveUpdateStream._cf.get(
-                event._id, column_reversed=True, column_count=1)
-        except NotFoundException:
-            event_last_modified = event._date
+    for event in LiveUpdateLiveEventsIndex.get_events():
+        if event.last_update_at:
+            event_last_modified = event.last_update_at
         else:
-            updates = LiveUpdateStream._column_to_obj([columns])
-            most_recent_update = updates.pop()
-            event_last_modified = most_recent_update._date
+            event_last_modified = _get_last_modified_from_stream(event)
 
         if event_last_modified < horizon:
             g.log.warning("Closing %s for inactivity.", event._id)
             close_event(event)
+
+
+def _is_indexable(event):
+    return event.state == "live" and not event.banned
+
+
+def reconcile_live_events_index():
+    """Repair drift between the live events index and the events themselves.
+
+    This is the one job that still scans every event, so it should run
+    rarely. The index is populated initially by
+    scripts/backfill/live_events_index.py.
+
+    """
+    indexed_ids = set(LiveUpdateLiveEventsIndex.get_ids())
+    live_ids = {event._id for event in LiveUpdateEvent._all()
+                if _is_indexable(event)}
+
+    # events may have been created, closed, banned or approved while we were
+    # scanning, so re-check the current state of each mismatch before fixing
+    mismatched_ids = list(indexed_ids ^ live_ids)
+    if not mismatched_ids:
+        return
+
+    events = LiveUpdateEvent._byID(mismatched_ids, return_dict=False)
+    missing = [event._id for event in events
+               if _is_indexable(event) and event._id not in indexed_ids]
+    stale = [event._id for event in events
+             if not _is_indexable(event) and event._id in indexed_ids]
+
+    if missing:
+        g.log.warning("Adding %d events to the live index.", len(missing))
+        LiveUpdateLiveEventsIndex.add(missing)
+
+    if stale:
+        g.log.warning("Removing %d events from the live index.", len(stale))
+        LiveUpdateLiveEventsIndex.remove(stale)
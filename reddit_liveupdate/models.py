@@ -1,9 +1,14 @@
+import collections
 import datetime
 import json
+import time
 import uuid
+import zlib
 
 import pytz
 
+from pycassa.batch import Mutator
+from pycassa.cassandra.ttypes import NotFoundException
 from pycassa.util import convert_uuid_to_time
 from pycassa.system_manager import TIME_UUID_TYPE, UTF8_TYPE
 from pylons import app_globals as g
@@ -13,9 +18,74 @@ from r2.lib.db import tdb_cassandra
 from r2.models import query_cache
 
 from r2.lib.contrib import simpleflake
+from reddit_liveupdate import encoding, stream_cache
 from reddit_liveupdate.permissions import ContributorPermissionSet
 
 
+def write_rows(row_keys, write_all, write_one):
+    """Write many rows at once, falling back to one at a time on failure.
+
+    `write_all` is called with all the row keys and should write them in as
+    few mutations as it can. If it fails, each row is retried on its own
+    with `write_one` so that one bad row doesn't fail the others. Part of a
+    failed batch may already have been applied, so `write_one` must write
+    the same columns and values as `write_all` did for that row. Returns a
+    dict of row key to exception for the rows that couldn't be written.
+
+    """
+    try:
+        write_all(row_keys)
+    except tdb_cassandra.TRANSIENT_EXCEPTIONS:
+        pass
+    else:
+        return {}
+
+    failures = {}
+    for row_key in row_keys:
+        try:
+            write_one(row_key)
+        except tdb_cassandra.TRANSIENT_EXCEPTIONS as e:
+            failures[row_key] = e
+    return failures
+
+
+def write_columns(rows, write_consistency_level=None):
+    """Write columns to rows of several column families in one mutation.
+
+    `rows` is a dict of (column family, row key) to a dict of column name to
+    value. This uses write_rows, so it returns a dict of (column family, row
+    key) to exception for the rows that couldn't be written.
+
+    """
+    def write_all(keys):
+        pool = keys[0][0].pool
+        with Mutator(pool,
+                     write_consistency_level=write_consistency_level) as m:
+            for cf, rowkey in keys:
+                m.insert(cf, rowkey, rows[(cf, rowkey)])
+
+    def write_one(key):
+        cf, rowkey = key
+        cf.insert(rowkey, rows[key],
+                  write_consistency_level=write_consistency_level)
+
+    return write_rows(rows.keys(), write_all, write_one)
+
+
+def insert_with_timestamps(cf, rowkey, columns):
+    """Write columns to a row, each with its own timestamp.
+
+    `columns` is a dict of column name to (value, timestamp). Backfills that
+    read columns and write them back pass timestamps based on the ones they
+    read, so anything written to a column after it was read has a later
+    timestamp and still wins over the backfill's write.
+
+    """
+    with cf.batch() as b:
+        for name, (value, timestamp) in columns.iteritems():
+            b.insert(rowkey, {name: value}, timestamp=timestamp)
+
+
 class LiveUpdateEvent(tdb_cassandra.Thing):
     _contributor_prefix = "contributor_"
     _discussion_prefix = "discussion_"
@@ -26,11 +96,17 @@ class LiveUpdateEvent(tdb_cassandra.Thing):
 
     _int_props = (
         "active_visitors",
+        "update_count",
+        "deleted_count",
     )
     _bool_props = (
         "active_visitors_fuzzed",
         "banned",
         "nsfw",
+        "stream_bucketed",
+    )
+    _date_props = (
+        "last_update_at",
     )
     _defaults = {
         "description": "",
@@ -42,40 +118,54 @@ class LiveUpdateEvent(tdb_cassandra.Thing):
         "banned": False,
         "banned_by": "(unknown)",
         "nsfw": False,
+        "update_count": 0,
+        "deleted_count": 0,
+        "last_update_at": None,
+        "stream_bucketed": False,
+        "stream_token": "",
     }
 
+    # contributors and hidden discussions used to be stored as prefixed
+    # columns in the event's own row. they now live in their own column
+    # families so that loading an event only reads its metadata. the legacy
+    # columns are still honored until scripts/backfill/split_event_rows.py has
+    # moved them.
     @classmethod
     def _contributor_key(cls, user):
         return "%s%s" % (cls._contributor_prefix, user._id36)
 
-    def add_contributor(self, user, permissions):
-        self[self._contributor_key(user)] = permissions.dumps()
+    def _remove_legacy_column(self, key):
+        try:
+            del self[key]
+        except KeyError:
+            return
         self._commit()
 
+    def add_contributor(self, user, permissions):
+        LiveUpdateContributorsByEvent.add(self, user, permissions)
+
     def update_contributor_permissions(self, user, permissions):
         return self.add_contributor(user, permissions)
 
     def remove_contributor(self, user):
-        del self[self._contributor_key(user)]
-        self._commit()
+        LiveUpdateContributorsByEvent.remove(self, user)
+        self._remove_legacy_column(self._contributor_key(user))
 
     @classmethod
     def _discussion_key(cls, link):
         return "%s%s" % (cls._discussion_prefix, link._id36)
 
     def hide_discussion(self, link):
-        self[self._discussion_key(link)] = ""
-        self._commit()
+        LiveUpdateHiddenDiscussionsByEvent.add(self, link)
 
     def unhide_discussion(self, link):
-        try:
-            del self[self._discussion_key(link)]
-        except KeyError:
-            pass
-        self._commit()
+        LiveUpdateHiddenDiscussionsByEvent.remove(self, link)
+        self._remove_legacy_column(self._discussion_key(link))
 
     def get_permissions(self, user):
-        permission_string = self._t.get(self._contributor_key(user), "")
+        permission_string = LiveUpdateContributorsByEvent.get(self, user)
+        if permission_string is None:
+            permission_string = self._t.get(self._contributor_key(user), "")
         return ContributorPermissionSet.loads(permission_string)
 
     @property
@@ -84,18 +174,29 @@ class LiveUpdateEvent(tdb_cassandra.Thing):
         return self._id
 
     @property
-    def contributors(self):
-        return {int(k[len(self._contributor_prefix):], 36):
-                    ContributorPermissionSet.loads(v)
+    def _legacy_contributors(self):
+        return {int(k[len(self._contributor_prefix):], 36): v
                 for k, v in self._t.iteritems()
                 if k.startswith(self._contributor_prefix)}
 
     @property
-    def hidden_discussions(self):
+    def _legacy_hidden_discussions(self):
         return {int(k[len(self._discussion_prefix):], 36)
                 for k in self._t.iterkeys()
                 if k.startswith(self._discussion_prefix)}
 
+    @property
+    def contributors(self):
+        permission_strings = self._legacy_contributors
+        permission_strings.update(LiveUpdateContributorsByEvent.get_all(self))
+        return {id: ContributorPermissionSet.loads(v)
+                for id, v in permission_strings.iteritems()}
+
+    @property
+    def hidden_discussions(self):
+        return (self._legacy_hidden_discussions |
+                LiveUpdateHiddenDiscussionsByEvent.get_all(self))
+
     def url(self, absolute=False):
         if absolute:
             prefix = g.https_endpoint
@@ -111,15 +212,82 @@ class LiveUpdateEvent(tdb_cassandra.Thing):
         event._commit()
         return event
 
+    def _partial_update(self, **changes):
+        thing = LiveUpdateEvent(_id=self._id, _partial=changes.keys())
+        thing._committed = True  # hack to prevent overwriting the date attr
+        for attr, value in changes.iteritems():
+            setattr(thing, attr, value)
+        thing._commit()
+
     @classmethod
-    def update_activity(cls, id, activity, fuzzed):
+    def _serialize_changes(cls, changes):
+        return {attr: cls._serialize_column(attr, value)
+                for attr, value in changes.iteritems()}
+
+    def stream_token_changes(self):
+        # every write that can change what a listing of the stream contains
+        # is followed by a new token, so a listing can be validated against
+        # the token alone without reading the stream.
+        return {"stream_token": str(uuid.uuid1())}
+
+    def record_stream_changed(self):
+        self._partial_update(**self.stream_token_changes())
+
+    def update_posted_changes(self, update):
+        # the count is read-modify-write and may drift under concurrent
+        # posts; scripts/backfill/stream_summaries.py recomputes it exactly.
+        return {
+            "update_count": self.update_count + 1,
+            "last_update_at": update._date,
+        }
+
+    def update_deleted_changes(self, update):
+        return {"deleted_count": self.deleted_count + 1}
+
+    @classmethod
+    def _activity_thing(cls, id, activity, fuzzed):
         thing = cls(_id=id, _partial=["active_visitors"])
         thing._committed = True  # hack to prevent overwriting the date attr
         thing.active_visitors = activity
         thing.active_visitors_fuzzed = fuzzed
+        return thing
+
+    @classmethod
+    def update_activity(cls, id, activity, fuzzed):
+        thing = cls._activity_thing(id, activity, fuzzed)
         thing._commit()
         return thing
 
+    @classmethod
+    def update_activity_multi(cls, activity_by_id):
+        """Update the activity of many events in one mutation.
+
+        `activity_by_id` is a dict of event id to (activity, fuzzed). Returns
+        a dict of id to partial event for each event that was updated and a
+        dict of id to exception for each that couldn't be.
+
+        """
+        def write_all(ids):
+            with cls._cf.batch(
+                    write_consistency_level=cls._write_consistency_level) as b:
+                for id in ids:
+                    activity, fuzzed = activity_by_id[id]
+                    b.insert(id, {
+                        "active_visitors": cls._serialize_column(
+                            "active_visitors", activity),
+                        "active_visitors_fuzzed": cls._serialize_column(
+                            "active_visitors_fuzzed", fuzzed),
+                    })
+
+        def write_one(id):
+            cls.update_activity(id, *activity_by_id[id])
+
+        failures = write_rows(activity_by_id.keys(), write_all, write_one)
+        things = {id: cls._activity_thing(id, *activity)
+                  for id, activity in activity_by_id.iteritems()
+                  if id not in failures}
+        return things, failures
+
 
 class FocusQuery(object):
     """A query-like object for focused updates."""
@@ -137,7 +305,184 @@ class FocusQuery(object):
         return iter(self.items)
 
 
+class LiveUpdateHeadQuery(object):
+    """A query-like object for the newest updates of a stream.
+
+    The head of the stream is served from the stream cache. If a listing
+    needs to page beyond the cached head, the remainder is fetched with a
+    regular stream query.
+
+    """
+    def __init__(self, event):
+        self.event = event
+        self.columns = LiveUpdateStream.get_head(event)
+        self._rules = []
+        self._limit = len(self.columns)
+        self._after_id = None
+        self._reversed = False
+
+    def _reverse(self):
+        self._reversed = True
+
+    def _after(self, item):
+        self._after_id = item._id
+
+    def __iter__(self):
+        if self._reversed:
+            return self._iter_oldest_first()
+        return self._iter_newest_first()
+
+    def _iter_newest_first(self):
+        start = 0
+        if self._after_id:
+            ids = [id for id, value in self.columns]
+            try:
+                start = ids.index(self._after_id) + 1
+            except ValueError:
+                start = len(self.columns)
+
+        window = self.columns[start:start + self._limit]
+        for id, value in window:
+            yield LiveUpdate.from_column(id, value)
+
+        remaining = self._limit - len(window)
+        exhausted = len(self.columns) < stream_cache.HEAD_SIZE
+        if remaining <= 0 or exhausted:
+            return
+
+        query = LiveUpdateStream.query_event(self.event, count=remaining)
+        if window:
+            query.column_start = window[-1][0]
+        elif self._after_id:
+            query.column_start = self._after_id
+        for item in query:
+            yield item
+
+    def _iter_oldest_first(self):
+        # everything newer than an update in the head is in the head too, so
+        # paging towards newer updates from inside it needs no reads.
+        ids = [id for id, value in self.columns]
+        if self._after_id in ids:
+            newer = self.columns[:ids.index(self._after_id)]
+            for id, value in list(reversed(newer))[:self._limit]:
+                yield LiveUpdate.from_column(id, value)
+            return
+
+        query = LiveUpdateStream.query_event(
+            self.event, count=self._limit, reverse=True)
+        if self._after_id:
+            query.column_start = self._after_id
+        for item in query:
+            yield item
+
+
+class BucketedStreamQuery(object):
+    """A query-like object walking the time buckets of a bucketed stream.
+
+    This behaves like the query returned by LiveUpdateStream.query (including
+    `column_start` for pagination) but transparently continues into the next
+    bucket row when one runs out.
+
+    """
+    def __init__(self, event, count, reverse=False):
+        self.event = event
+        self.column_start = None
+        self.reverse = reverse
+        self._limit = count
+        self._rules = []
+
+    def _reverse(self):
+        # the direction may already have been passed to the constructor, so
+        # this sets it rather than flipping it.
+        self.reverse = True
+
+    def _after(self, item):
+        self.column_start = item._id
+
+    def __iter__(self):
+        remaining = self._limit
+        column_start = self.column_start
+        rowkeys = LiveUpdateStream._rowkeys(
+            self.event, start=column_start, reverse=self.reverse)
+
+        for rowkey in rowkeys:
+            query = LiveUpdateStream.query(
+                [rowkey], count=remaining, reverse=self.reverse)
+            if column_start:
+                query.column_start = column_start
+                column_start = None
+
+            for item in query:
+                yield item
+
+                remaining -= 1
+                if remaining <= 0:
+                    return
+
+
+class TombstoneSkippingQuery(object):
+    """A query-like wrapper that drops deleted updates by id.
+
+    Tombstoned updates are recognized by their id alone so they are never
+    decoded, and the underlying query is allowed to read past them so that a
+    page can be filled in a single round instead of repeated refetches.
+
+    """
+    def __init__(self, query, tombstones):
+        self.query = query
+        self.tombstones = tombstones
+        self._limit = getattr(query, "_limit", None)
+
+    @property
+    def _rules(self):
+        return self.query._rules
+
+    @_rules.setter
+    def _rules(self, rules):
+        self.query._rules = rules
+
+    def _reverse(self):
+        self.query._reverse()
+
+    def _after(self, item):
+        self.query._after(item)
+
+    def __iter__(self):
+        if self._limit is None:
+            for item in self.query:
+                if item._id not in self.tombstones:
+                    yield item
+            return
+
+        # stop pulling from the underlying query (and therefore reading more
+        # columns) as soon as the page is full.
+        self.query._limit = self._limit + len(self.tombstones)
+        remaining = self._limit
+        for item in self.query:
+            if item._id in self.tombstones:
+                continue
+
+            yield item
+
+            remaining -= 1
+            if remaining <= 0:
+                return
+
+
+def _get_stream_bucket(update_id):
+    timestamp = convert_uuid_to_time(update_id)
+    return int(timestamp // LiveUpdateStream._bucket_seconds)
+
+
 class LiveUpdateStream(tdb_cassandra.View):
+    """The updates of each live thread, keyed by TimeUUID.
+
+    Streams of events with `stream_bucketed` set are split across one row per
+    time bucket (see LiveUpdateStreamBucketsByEvent) so that a long running
+    thread doesn't grow a single unbounded row. All other events keep their
+    whole stream in a row keyed by the event id.
+
+    """
     _use_db = True
     _connection_pool = "main"
     _compare_with = TIME_UUID_TYPE
@@ -147,14 +492,112 @@ class LiveUpdateStream(tdb_cassandra.View):
         "default_validation_class": UTF8_TYPE,
     }
 
+    _bucket_seconds = 7 * 24 * 60 * 60
+
+    @classmethod
+    def _bucket_rowkey(cls, event_id, bucket):
+        return "%s.%d" % (event_id, bucket)
+
+    @classmethod
+    def _rowkey(cls, event, update_id):
+        if not event.stream_bucketed:
+            return event._id
+        bucket = _get_stream_bucket(update_id)
+        return cls._bucket_rowkey(event._id, bucket)
+
+    @classmethod
+    def _rowkeys(cls, event, start=None, reverse=False):
+        """Return the rows a slice starting at `start` has to walk, in order.
+
+        The default order is newest first; `reverse` is oldest first.
+
+        """
+        if not event.stream_bucketed:
+            return [event._id]
+
+        buckets = LiveUpdateStreamBucketsByEvent.get_buckets(event)
+        if start:
+            start_bucket = _get_stream_bucket(start)
+            if reverse:
+                buckets = [b for b in buckets if b >= start_bucket]
+            else:
+                buckets = [b for b in buckets if b <= start_bucket]
+
+        if not reverse:
+            buckets = reversed(buckets)
+        return [cls._bucket_rowkey(event._id, b) for b in buckets]
+
+    @classmethod
+    def copy_unbucketed_row(cls, event):
+        """Copy an event's single-row stream into its bucket rows.
+
+        Columns keep their original timestamps so that a copy made after the
+        bucket rows have been written to doesn't revert those writes.
+
+        """
+        columns = cls._cf.xget(event._id, include_timestamp=True)
+        for chunk in utils.in_chunks(columns, size=100):
+            by_bucket = collections.defaultdict(dict)
+            for id, value_and_timestamp in chunk:
+                by_bucket[_get_stream_bucket(id)][id] = value_and_timestamp
+
+            for bucket, bucket_columns in by_bucket.iteritems():
+                LiveUpdateStreamBucketsByEvent.add(event, bucket)
+                insert_with_timestamps(
+                    cls._cf, cls._bucket_rowkey(event._id, bucket),
+                    bucket_columns)
+
+    @classmethod
+    def query_event(cls, event, count, reverse=False):
+        """Return a query over an event's stream regardless of its layout."""
+        if not event.stream_bucketed:
+            return cls.query([event._id], count=count, reverse=reverse)
+        return BucketedStreamQuery(event, count=count, reverse=reverse)
+
+    @classmethod
+    def add_update(cls, event, update, event_changes=None):
+        """Write an update to the stream.
+
+        The event gets a new stream token along with any other changes to its
+        attributes in `event_changes`. The update, the event's changes and
+        the bucket index (for bucketed streams) are written in one mutation.
+
+        """
+        changes = event.stream_token_changes()
+        changes.update(event_changes or {})
+
+        rows = {
+            (cls._cf, cls._rowkey(event, update._id)):
+                cls._obj_to_column(update),
+            (LiveUpdateEvent._cf, event._id):
+                LiveUpdateEvent._serialize_changes(changes),
+        }
+        if event.stream_bucketed:
+            bucket = _get_stream_bucket(update._id)
+            rows[(LiveUpdateStreamBucketsByEvent._cf, event._id)] = {
+                bucket: ""}
+
+        failures = write_columns(
+            rows, write_consistency_level=cls._write_consistency_level)
+        stream_cache.invalidate(event._id)
+        if failures:
+            raise failures.values()[0]
+
+    @classmethod
+    def _fetch_head(cls, event):
+        query = cls.query_event(event, count=stream_cache.HEAD_SIZE)
+        return [(update._id, update._raw) for update in query]
+
     @classmethod
-    def add_update(cls, event, update):
-        columns = cls._obj_to_column(update)
-        cls._set_values(event._id, columns)
+    def get_head(cls, event):
+        """Return (id, raw value) tuples of the newest updates."""
+        return stream_cache.get_head(
+            event._id, event.stream_token,
+            lambda event_id: cls._fetch_head(event))
 
     @classmethod
     def get_update(cls, event, id, read_consistency_level=None):
-        thing = cls._byID(event._id, properties=[id],
+        thing = cls._byID(cls._rowkey(event, id), properties=[id],
                           read_consistency_level=read_consistency_level)
 
         try:
@@ -162,23 +605,114 @@ class LiveUpdateStream(tdb_cassandra.View):
         except KeyError:
             raise tdb_cassandra.NotFound, "<LiveUpdate %s>" % id
         else:
-            return LiveUpdate.from_json(id, data)
+            return LiveUpdate.from_column(id, data)
 
     @classmethod
     def _obj_to_column(cls, entries):
         entries, is_single = utils.tup(entries, ret_is_single=True)
-        columns = [{entry._id: entry.to_json()} for entry in entries]
+        columns = [{entry._id: entry.to_column()} for entry in entries]
         return columns[0] if is_single else columns
 
     @classmethod
     def _column_to_obj(cls, columns):
         # columns = [{colname: colvalue}]
-        return [LiveUpdate.from_json(*column.popitem())
+        return [LiveUpdate.from_column(*column.popitem())
                 for column in utils.tup(columns)]
 
 
+class LiveUpdateStreamBucketsByEvent(tdb_cassandra.View):
+    """An index of the time buckets that hold updates of a bucketed stream."""
+    _use_db = True
+    _connection_pool = "main"
+    _compare_with = "LongType"
+    _value_type = "str"
+    _read_consistency_level = tdb_cassandra.CL.ONE
+    _write_consistency_level = tdb_cassandra.CL.QUORUM
+
+    @classmethod
+    def add(cls, event, bucket):
+        cls._set_values(event._id, {bucket: ""})
+
+    @classmethod
+    def get_buckets(cls, event):
+        """Return the event's bucket numbers in ascending order."""
+        try:
+            columns = cls._cf.get(event._id, column_count=10000)
+        except NotFoundException:
+            return []
+        return list(columns.keys())
+
+
+class LiveUpdateTombstonesByEvent(tdb_cassandra.View):
+    """An index of the deleted updates in each stream.
+
+    Spam updates are still shown to contributors, so they aren't indexed
+    here and are left to the listing builder to filter.
+
+    """
+    _use_db = True
+    _connection_pool = "main"
+    _compare_with = TIME_UUID_TYPE
+    _value_type = "str"
+    _read_consistency_level = tdb_cassandra.CL.ONE
+    _write_consistency_level = tdb_cassandra.CL.QUORUM
+    _extra_schema_creation_args = {
+        "default_validation_class": "AsciiType",
+    }
+
+    # the most tombstones to consider for a single listing page
+    _max_tombstones = 1000
+
+    @classmethod
+    def add(cls, event, update, reason):
+        cls._set_values(event._id, {update._id: reason})
+        stream_cache.invalidate(event._id)
+        event.record_stream_changed()
+
+    @classmethod
+    def _fetch(cls, event_id, column_start="", reverse=False):
+        try:
+            columns = cls._cf.get(
+                event_id,
+                column_start=column_start,
+                column_reversed=not reverse,
+                column_count=cls._max_tombstones,
+            )
+        except NotFoundException:
+            return {}
+        return dict(columns)
+
+    @classmethod
+    def get_tombstones(cls, event, after=None, reverse=False):
+        """Return the ids of deleted updates in a listing's direction.
+
+        Tombstones for the head of the stream are served from the stream
+        cache.
+
+        """
+        if after:
+            tombstones = cls._fetch(event._id, column_start=after,
+                                    reverse=reverse)
+        else:
+            tombstones = stream_cache.get_tombstones(
+                event._id, event.stream_token, cls._fetch)
+
+        # streams may still hold tombstones for spam from before spam was
+        # left out of the index.
+        return {id for id, reason in tombstones.iteritems()
+                if reason == "deleted"}
+
+
 class LiveUpdate(object):
-    __slots__ = ("_id", "_data")
+    """A single update in a live thread.
+
+    Updates loaded from the stream keep their raw column value and only
+    decode it when data is first needed. The id and date are always available
+    without decoding and, for columns in the current format, so are the
+    deleted, spam, and stricken flags.
+
+    """
+    __slots__ = ("_id", "_data", "_raw")
     defaults = {
         "deleted": False,
         "stricken": False,
@@ -187,13 +721,27 @@ class LiveUpdate(object):
         "mobile_objects": [],
     }
 
-    def __init__(self, id=None, data=None):
+    def __init__(self, id=None, data=None, raw=None):
         if not id:
             id = uuid.uuid1()
         self._id = id
-        self._data = data or {}
+        self._raw = raw
+        if raw is None:
+            self._data = data or {}
 
     def __getattr__(self, name):
+        if name == "_data":
+            # only reachable while the raw column hasn't been decoded yet
+            data = encoding.decode(self._raw)
+            self._data = data
+            self._raw = None
+            return data
+
+        if self._raw is not None and name in encoding.FLAG_FIELDS:
+            flags = encoding.decode_flags(self._raw)
+            if flags is not None:
+                return flags[name]
+
         try:
             return self._data[name]
         except KeyError:
@@ -208,12 +756,12 @@ class LiveUpdate(object):
         else:
             self._data[name] = value
 
-    def to_json(self):
-        return json.dumps(self._data)
+    def to_column(self):
+        return encoding.encode(self._data, defaults=LiveUpdate.defaults)
 
     @classmethod
-    def from_json(cls, id, value):
-        return cls(id, json.loads(value))
+    def from_column(cls, id, value):
+        return cls(id, raw=value)
 
     @property
     def _date(self):
@@ -245,7 +793,61 @@ class LiveUpdate(object):
         # can filter these results down here if needed
         return self.mobile_objects
 
+
+ACTIVITY_RESOLUTIONS = {
+    "minute": 60,
+    "hour": 60 * 60,
+    "day": 24 * 60 * 60,
+}
+
+ActivityBucket = collections.namedtuple(
+    "ActivityBucket", ["start", "min", "max", "avg"])
+
+
+def _get_activity_bucket(timestamp, resolution):
+    size = ACTIVITY_RESOLUTIONS[resolution]
+    return int(timestamp) // size * size
+
+
+class ActivityStats(object):
+    """Running min/max/average of a set of activity samples."""
+    def __init__(self, min=None, max=None, total=0, count=0):
+        self.min = min
+        self.max = max
+        self.total = total
+        self.count = count
+
+    def add(self, value):
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.total += value
+        self.count += 1
+
+    def to_bucket(self, start):
+        return ActivityBucket(
+            start=datetime.datetime.fromtimestamp(start, pytz.UTC),
+            min=self.min,
+            max=self.max,
+            avg=float(self.total) / self.count,
+        )
+
+    def serialize(self):
+        return "%d:%d:%d:%d" % (self.min, self.max, self.total, self.count)
+
+    @classmethod
+    def parse(cls, value):
+        if not value:
+            return cls()
+        return cls(*(int(field) for field in value.split(":")))
+
+
 class LiveUpdateActivityHistoryByEvent(tdb_cassandra.View):
+    """Raw viewer count samples taken by each run of the activity job.
+
+    Samples expire after a week. Longer term history is kept as hourly and
+    daily rollups in LiveUpdateActivityRollupsByEvent.
+
+    """
     _use_db = True
     _connection_pool = "main"
     _compare_with = "TimeUUIDType"
@@ -255,10 +857,403 @@ class LiveUpdateActivityHistoryByEvent(tdb_cassandra.View):
     _extra_schema_creation_args = {
         "default_validation_class": "IntegerType",
     }
+    _ttl = datetime.timedelta(days=7)
 
     @classmethod
     def record_activity(cls, event_id, activity_count):
         cls._set_values(event_id, {uuid.uuid1(): activity_count})
+        LiveUpdateActivityRollupsByEvent.record(event_id, activity_count)
+
+    @classmethod
+    def record_activity_multi(cls, activity_counts):
+        """Record samples for many events in a couple of mutations.
+
+        `activity_counts` is a dict of event id to viewer count. Returns a
+        dict of event id to exception for each event whose sample or rollups
+        couldn't be written.
+
+        """
+        # each sample's id is picked up front so that retrying a row after a
+        # partly applied batch rewrites the same column instead of adding a
+        # second sample.
+        samples = {event_id: {uuid.uuid1(): count}
+                   for event_id, count in activity_counts.iteritems()}
+
+        def write_all(event_ids):
+            with cls._cf.batch(
+                    write_consistency_level=cls._write_consistency_level) as b:
+                for event_id in event_ids:
+                    cls._set_values(event_id, samples[event_id], batch=b)
+
+        def write_one(event_id):
+            cls._set_values(event_id, samples[event_id])
+
+        failures = write_rows(activity_counts.keys(), write_all, write_one)
+        recorded = {event_id: count
+                    for event_id, count in activity_counts.iteritems()
+                    if event_id not in failures}
+        failures.update(
+            LiveUpdateActivityRollupsByEvent.record_multi(recorded))
+        return failures
+
+    @classmethod
+    def get_series(cls, event_id, start, end, resolution):
+        """Return the viewer counts of an event between two datetimes.
+
+        The series is a list of ActivityBucket in chronological order, one
+        per `resolution` sized bucket that has any samples. Minute resolution
+        is only available as far back as raw samples are kept.
+
+        """
+        if resolution != "minute":
+            return LiveUpdateActivityRollupsByEvent.get_series(
+                event_id, start, end, resolution)
+
+        columns = cls._cf.xget(
+            event_id, column_start=start, column_finish=end)
+
+        buckets = collections.OrderedDict()
+        for sample_id, count in columns:
+            bucket = _get_activity_bucket(
+                convert_uuid_to_time(sample_id), resolution)
+            buckets.setdefault(bucket, ActivityStats()).add(count)
+        return [stats.to_bucket(bucket)
+                for bucket, stats in buckets.iteritems()]
+
+
+class LiveUpdateActivityRollupsByEvent(tdb_cassandra.View):
+    """Hourly and daily min/max/average viewer counts of each event.
+
+    Each row holds one resolution for one event and each column is keyed by
+    the epoch time of the start of its bucket.
+
+    """
+    _use_db = True
+    _connection_pool = "main"
+    _compare_with = "LongType"
+    _value_type = "str"
+    _read_consistency_level = tdb_cassandra.CL.QUORUM
+    _write_consistency_level = tdb_cassandra.CL.QUORUM
+    _extra_schema_creation_args = {
+        "key_validation_class": "AsciiType",
+        "default_validation_class": "AsciiType",
+    }
+
+    resolutions = ("hour", "day")
+
+    @classmethod
+    def _rowkey(cls, event_id, resolution):
+        return "%s.%s" % (event_id, resolution)
+
+    @classmethod
+    def _get_updated_stats(cls, activity_counts, timestamp):
+        # this is read-modify-write, which is fine because the activity job
+        # is the only writer and it samples each event once per run.
+        buckets = {resolution: _get_activity_bucket(timestamp, resolution)
+                   for resolution in cls.resolutions}
+        rows = {cls._rowkey(event_id, resolution): (event_id, resolution)
+                for event_id in activity_counts
+                for resolution in cls.resolutions}
+
+        existing = cls._cf.multiget(
+            rows.keys(), columns=list(set(buckets.values())))
+
+        updated = {}
+        for rowkey, (event_id, resolution) in rows.iteritems():
+            bucket = buckets[resolution]
+            stats = ActivityStats.parse(existing.get(rowkey, {}).get(bucket))
+            stats.add(activity_counts[event_id])
+            updated[rowkey] = (event_id, {bucket: stats.serialize()})
+        return updated
+
+    @classmethod
+    def record(cls, event_id, activity_count, timestamp=None):
+        updated = cls._get_updated_stats(
+            {event_id: activity_count}, timestamp or time.time())
+        for rowkey, (event_id, columns) in updated.iteritems():
+            cls._set_values(rowkey, columns)
+
+    @classmethod
+    def record_multi(cls, activity_counts, timestamp=None):
+        """Record samples for many events at once.
+
+        Returns a dict of event id to exception for each event whose rollups
+        couldn't be updated.
+
+        """
+        if not activity_counts:
+            return {}
+
+        try:
+            updated = cls._get_updated_stats(
+                activity_counts, timestamp or time.time())
+        except tdb_cassandra.TRANSIENT_EXCEPTIONS as e:
+            return {event_id: e for event_id in activity_counts}
+
+        def write_all(rowkeys):
+            with cls._cf.batch(
+                    write_consistency_level=cls._write_consistency_level) as b:
+                for rowkey in rowkeys:
+                    cls._set_values(rowkey, updated[rowkey][1], batch=b)
+
+        def write_one(rowkey):
+            cls._set_values(rowkey, updated[rowkey][1])
+
+        failures = write_rows(updated.keys(), write_all, write_one)
+        return {updated[rowkey][0]: e for rowkey, e in failures.iteritems()}
+
+    @classmethod
+    def set_rollups(cls, event_id, resolution, stats_by_bucket):
+        cls._set_values(cls._rowkey(event_id, resolution), {
+            bucket: stats.serialize()
+            for bucket, stats in stats_by_bucket.iteritems()
+        })
+
+    @classmethod
+    def get_series(cls, event_id, start, end, resolution):
+        if resolution not in cls.resolutions:
+            raise ValueError("unknown resolution %r" % resolution)
+
+        columns = cls._cf.xget(
+            cls._rowkey(event_id, resolution),
+            column_start=_get_activity_bucket(
+                utils.epoch_timestamp(start), resolution),
+            column_finish=int(utils.epoch_timestamp(end)),
+        )
+        return [ActivityStats.parse(value).to_bucket(bucket)
+                for bucket, value in columns]
+
+
+def get_event_shard(event_id, shard_count):
+    """Return which of `shard_count` shards an event belongs to.
+
+    This is a stable hash of the id so that every process agrees.
+
+    """
+    return (zlib.crc32(event_id) & 0xffffffff) % shard_count
+
+
+class LiveUpdateLiveEventsIndex(tdb_cassandra.View):
+    """The ids of every event that is live and not banned.
+
+    Background jobs iterate this instead of every event ever created. The
+    index is seeded by scripts/backfill/live_events_index.py and maintained
+    as events are created, closed, banned and approved;
+    housekeeping.reconcile_live_events_index repairs any drift.
+
+    """
+    _use_db = True
+    _compare_with = "AsciiType"
+    _value_type = "str"
+    _read_consistency_level = tdb_cassandra.CL.QUORUM
+    _write_consistency_level = tdb_cassandra.CL.QUORUM
+    _extra_schema_creation_args = {
+        "key_validation_class": "AsciiType",
+        "default_validation_class": "AsciiType",
+    }
+
+    _rowkey = "live"
+
+    @classmethod
+    def add(cls, event_ids):
+        cls._set_values(cls._rowkey, {event_id: "" for event_id in event_ids})
+
+    @classmethod
+    def remove(cls, event_ids):
+        cls._remove(cls._rowkey, list(event_ids))
+
+    @classmethod
+    def get_ids(cls):
+        return [event_id for event_id, value in cls._cf.xget(cls._rowkey)]
+
+    @classmethod
+    def get_events(cls, shard=0, shard_count=1):
+        """Yield the events in the index that are still live and unbanned.
+
+        If `shard_count` is more than one, only the events that belong to
+        `shard` are included.
+
+        Until scripts/backfill/live_events_index.py has seeded the index it
+        is empty, so an empty index falls back to scanning every event.
+
+        """
+        event_ids = cls.get_ids()
+        if event_ids:
+            events = (event
+                      for chunk in utils.in_chunks(event_ids, size=100)
+                      for event in LiveUpdateEvent._byID(
+                          chunk, return_dict=False))
+        else:
+            g.log.warning("live events index is empty, scanning all events")
+            g.stats.simple_event("liveupdate.live_events_index.empty")
+            events = LiveUpdateEvent._all()
+
+        for event in events:
+            if shard_count > 1:
+                if get_event_shard(event._id, shard_count) != shard:
+                    continue
+            if event.state == "live" and not event.banned:
+                yield event
+
+
+class LiveUpdateActiveEventsByShard(tdb_cassandra.View):
+    """The most active events found by each shard of the activity job.
+
+    Each shard writes its list to a column named for itself and the number
+    of shards, and the lists are merged into the "most active" listing.
+    Columns expire so that a shard which stops running drops out of the
+    merge rather than leaving stale counts behind.
+
+    """
+    _use_db = True
+    _compare_with = "AsciiType"
+    _value_type = "str"
+    _read_consistency_level = tdb_cassandra.CL.QUORUM
+    _write_consistency_level = tdb_cassandra.CL.QUORUM
+    _extra_schema_creation_args = {
+        "key_validation_class": "AsciiType",
+        "default_validation_class": "UTF8Type",
+    }
+    _ttl = datetime.timedelta(minutes=5)
+
+    _rowkey = "top"
+
+    @classmethod
+    def set_top(cls, shard, shard_count, top):
+        """Store a shard's list of (event id, count, fuzzed) tuples."""
+        column = "%d/%d" % (shard, shard_count)
+        cls._set_values(cls._rowkey, {column: json.dumps(top)})
+
+    @classmethod
+    def get_top(cls, shard_count, limit):
+        """Return the merged lists of all shards, most active first."""
+        merged = []
+        for column, value in cls._cf.xget(cls._rowkey):
+            if not column.endswith("/%d" % shard_count):
+                # written when there were a different number of shards
+                continue
+            merged.extend(tuple(entry) for entry in json.loads(value))
+        merged.sort(key=lambda entry: entry[1], reverse=True)
+        return merged[:limit]
+
+
+class LiveUpdateChangesByEvent(tdb_cassandra.View):
+    """A short-lived journal of the changes broadcast to each thread.
+
+    Clients that missed websocket messages (e.g. while reconnecting) can
+    catch up from the journal with a single slice read instead of fetching
+    whole listings again.
+
+    """
+    _use_db = True
+    _connection_pool = "main"
+    _compare_with = TIME_UUID_TYPE
+    _value_type = "str"
+    _read_consistency_level = tdb_cassandra.CL.ONE
+    _write_consistency_level = tdb_cassandra.CL.QUORUM
+    _extra_schema_creation_args = {
+        "default_validation_class": UTF8_TYPE,
+    }
+    _ttl = datetime.timedelta(days=1)
+
+    @classmethod
+    def record(cls, event_id, type, payload):
+        change = json.dumps({"type": type, "payload": payload})
+        cls._set_values(event_id, {uuid.uuid1(): change})
+
+    @classmethod
+    def is_expired(cls, cursor):
+        """Return if changes since the cursor may have expired already."""
+        age = time.time() - convert_uuid_to_time(cursor)
+        return age > cls._ttl.total_seconds()
+
+    @classmethod
+    def get_since(cls, event_id, cursor, count):
+        """Return up to count (id, type, payload) changes made after cursor.
+
+        Changes are returned oldest first.
+
+        """
+        try:
+            columns = cls._cf.get(
+                event_id, column_start=cursor, column_count=count + 1)
+        except NotFoundException:
+            return []
+
+        changes = []
+        for change_id, value in columns.iteritems():
+            if change_id == cursor:
+                continue
+            change = json.loads(value)
+            changes.append((change_id, change["type"], change["payload"]))
+        return changes[:count]
+
+
+class LiveUpdateContributorsByEvent(tdb_cassandra.View):
+    _use_db = True
+    _compare_with = "AsciiType"
+    _value_type = "str"
+    _read_consistency_level = tdb_cassandra.CL.ONE
+    _write_consistency_level = tdb_cassandra.CL.QUORUM
+    _extra_schema_creation_args = {
+        "key_validation_class": "AsciiType",
+    }
+
+    @classmethod
+    def add(cls, event, user, permissions):
+        cls._set_values(event._id, {user._id36: permissions.dumps()})
+
+    @classmethod
+    def remove(cls, event, user):
+        cls._remove(event._id, [user._id36])
+
+    @classmethod
+    def get(cls, event, user):
+        """Return the user's raw permission string or None."""
+        try:
+            row = cls._byID(event._id, properties=[user._id36])
+            return row[user._id36]
+        except (tdb_cassandra.NotFound, KeyError):
+            return None
+
+    @classmethod
+    def get_all(cls, event):
+        """Return a dict of contributor id to raw permission string."""
+        try:
+            contributors = cls._byID(event._id)._values()
+        except tdb_cassandra.NotFound:
+            return {}
+        else:
+            return {int(k, 36): v for k, v in contributors.iteritems()}
+
+
+class LiveUpdateHiddenDiscussionsByEvent(tdb_cassandra.View):
+    _use_db = True
+    _compare_with = "AsciiType"
+    _value_type = "str"
+    _read_consistency_level = tdb_cassandra.CL.ONE
+    _write_consistency_level = tdb_cassandra.CL.QUORUM
+    _extra_schema_creation_args = {
+        "key_validation_class": "AsciiType",
+    }
+
+    @classmethod
+    def add(cls, event, link):
+        cls._set_values(event._id, {link._id36: ""})
+
+    @classmethod
+    def remove(cls, event, link):
+        cls._remove(event._id, [link._id36])
+
+    @classmethod
+    def get_all(cls, event):
+        """Return the set of hidden link ids."""
+        try:
+            hidden = cls._byID(event._id)._values()
+        except tdb_cassandra.NotFound:
+            return set()
+        else:
+            return {int(k, 36) for k in hidden}
 
 
 class InviteNotFoundError(Exception):
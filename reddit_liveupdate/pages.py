@@ -17,8 +17,9 @@ from r2.lib.menus import NavMenu, NavButton
 from r2.lib.template_helpers import add_sr
 from r2.lib.wrapped import Templated, Wrapped
 from r2.models import Account, Listing, UserListing
+from r2.models.builder import Builder
 from r2.lib.template_helpers import static
-from r2.lib.utils import trunc_string
+from r2.lib.utils import epoch_timestamp, trunc_string
 from r2.lib.jsontemplates import (
     JsonTemplate,
     ObjectTemplate,
@@ -26,7 +27,6 @@ from r2.lib.jsontemplates import (
     UserTableItemJsonTemplate,
 )
 
-from reddit_liveupdate.discussions import get_discussions
 from reddit_liveupdate.permissions import ContributorPermissionSet
 from reddit_liveupdate.utils import pretty_time
 
@@ -220,6 +220,22 @@ class LiveUpdateEventEmbed(LiveUpdateEventPage):
         super(LiveUpdateEventEmbed, self).__init__(*args, **kwargs)
 
 
+def render_event_markdown(text):
+    return filters.safemarkdown(text, nofollow=True) or ""
+
+
+def get_event_html(event, attr):
+    """Return the stored html rendering of an event's markdown attribute.
+
+    Events created before the html was stored are rendered on the fly.
+
+    """
+    html = getattr(event, attr + "_html", None)
+    if html is None:
+        html = render_event_markdown(getattr(event, attr))
+    return html
+
+
 class LiveUpdateEventJsonTemplate(ThingJsonTemplate):
     _data_attrs_ = ThingJsonTemplate.data_attrs(
         id="_id",
@@ -234,6 +250,9 @@ class LiveUpdateEventJsonTemplate(ThingJsonTemplate):
         resources="resources",
         resources_html="resources_html",
         websocket_url="websocket_url",
+        update_count="update_count",
+        deleted_count="deleted_count",
+        last_update_utc="last_update_utc",
     )
 
     def thing_attr(self, thing, attr):
@@ -256,11 +275,13 @@ class LiveUpdateEventJsonTemplate(ThingJsonTemplate):
                 return None
             return thing.total_views
         elif attr == "description_html":
-            return filters.spaceCompress(
-                filters.safemarkdown(thing.description, nofollow=True) or "")
+            return filters.spaceCompress(get_event_html(thing, "description"))
         elif attr == "resources_html":
-            return filters.spaceCompress(
-                filters.safemarkdown(thing.resources, nofollow=True) or "")
+            return filters.spaceCompress(get_event_html(thing, "resources"))
+        elif attr == "last_update_utc":
+            if not thing.last_update_at:
+                return None
+            return epoch_timestamp(thing.last_update_at)
         elif attr == "websocket_url":
             if thing.state == "live":
                 return websockets.make_url(
@@ -294,19 +315,21 @@ REPORT_TYPES = collections.OrderedDict((
 ))
 
 
+def get_contributor_accounts(event):
+    contributor_accounts = Account._byID(event.contributors.keys(),
+                                         data=True, return_dict=False)
+    return sorted((LiveUpdateAccount(e) for e in contributor_accounts),
+                  key=lambda e: e.name)
+
+
 class LiveUpdateEventApp(Templated):
-    def __init__(self, event, listing, show_sidebar, report_type):
+    def __init__(self, event, listing, show_sidebar, report_type,
+                 contributors, discussions):
         self.event = event
         self.listing = listing
-        if show_sidebar:
-            self.discussions = LiveUpdateOtherDiscussions()
+        self.discussions = discussions
         self.show_sidebar = show_sidebar
-
-        contributor_accounts = Account._byID(event.contributors.keys(),
-                                             data=True, return_dict=False)
-        self.contributors = sorted((LiveUpdateAccount(e)
-                                   for e in contributor_accounts),
-                                   key=lambda e: e.name)
+        self.contributors = contributors
 
         self.report_types = REPORT_TYPES
         self.report_type = report_type
@@ -444,6 +467,23 @@ class LiveUpdateEventAppJsonTemplate(JsonTemplate):
         return ObjectTemplate(thing.listing.render() if thing else {})
 
 
+# bump this whenever the rendering of update bodies changes so that html
+# stored with older updates gets re-rendered when read.
+BODY_HTML_VERSION = 1
+
+
+def prerender_update_body(update):
+    """Render an update's body and store the html on it for later reads."""
+    update.body_html = filters.safemarkdown(update.body, nofollow=True) or ""
+    update.body_html_version = BODY_HTML_VERSION
+
+
+def get_update_body_html(update):
+    if getattr(update, "body_html_version", None) == BODY_HTML_VERSION:
+        return update.body_html
+    return filters.safemarkdown(update.body, nofollow=True) or ""
+
+
 class LiveUpdateJsonTemplate(ThingJsonTemplate):
     _data_attrs_ = ThingJsonTemplate.data_attrs(
         id="_id",
@@ -459,7 +499,7 @@ class LiveUpdateJsonTemplate(ThingJsonTemplate):
         if attr == "_id":
             return str(thing._id)
         elif attr == "body_html":
-            return filters.spaceCompress(filters.safemarkdown(thing.body, nofollow=True))
+            return filters.spaceCompress(thing.body_html)
         elif attr == "author":
             if not thing.author.deleted:
                 return thing.author.name
@@ -492,13 +532,12 @@ def make_submit_url(event):
 class LiveUpdateOtherDiscussions(Templated):
     max_links = 5
 
-    def __init__(self):
-        builder = get_discussions(c.liveupdate_event, limit=self.max_links+1)
-        links, prev, next, bcount, acount = builder.get_items()
-
+    def __init__(self, event, links):
+        # the links are looked up without the request's context (see
+        # discussions.get_discussion_links) and only wrapped for the user here
         self.more_links = len(links) > self.max_links
-        self.links = links[:self.max_links]
-        self.submit_url = make_submit_url(c.liveupdate_event)
+        self.links = Builder().wrap_items(links[:self.max_links])
+        self.submit_url = make_submit_url(event)
 
         Templated.__init__(self)
 
@@ -538,6 +577,7 @@ def liveupdate_add_props(user, wrapped):
 
     for item in wrapped:
         item.author = LiveUpdateAccount(accounts[item.author_id])
+        item.body_html = get_update_body_html(item)
 
         item.date_str = pretty_time(item._date)
 
@@ -0,0 +1,267 @@
+"""Recording of activity pixel hits.
+
+The pixel is requested every few seconds by every open copy of a live
+thread, so instead of one call to the activity service per hit, hits are
+collected in a per-process buffer and sent in batches. A visitor is only
+sent once per DEDUPE_WINDOW for each thread, which doesn't affect the
+counts since the activity service counts unique visitors over a much longer
+window anyway.
+
+"""
+import hashlib
+import os
+import Queue
+import re
+import threading
+import time
+
+import pylons
+
+from pylons import app_globals as g
+from pylons.util import AttribSafeContextObj
+from thrift.transport.TTransport import TTransportException
+
+from r2.lib import baseplate_integration
+
+from reddit_liveupdate import hll
+
+
+# send the buffered hits when this many are waiting or the oldest of them
+# has waited this many seconds
+FLUSH_SIZE = 500
+FLUSH_INTERVAL = 5
+
+# how long to ignore repeat hits from a visitor to the same thread
+DEDUPE_WINDOW = 60
+
+
+class ActivityBuffer(object):
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 dedupe_window=DEDUPE_WINDOW):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.dedupe_window = dedupe_window
+
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.sent = {}
+        self.last_flush = time.time()
+
+    def add(self, context_id, visitor_id, now=None):
+        """Buffer a hit and return a batch of hits if one is due to be sent.
+
+        The batch is a list of (context id, visitor id) tuples which the
+        caller is responsible for sending.
+
+        """
+        now = now or time.time()
+        key = (context_id, visitor_id)
+
+        with self.lock:
+            sent_at = self.sent.get(key)
+            if sent_at is None or now - sent_at >= self.dedupe_window:
+                self.pending.add(key)
+
+            if (len(self.pending) >= self.flush_size or
+                    (self.pending and
+                     now - self.last_flush >= self.flush_interval)):
+                return self._take_batch(now)
+        return None
+
+    def _take_batch(self, now):
+        batch = list(self.pending)
+        self.pending = set()
+        self.last_flush = now
+
+        self.sent = {key: sent_at for key, sent_at in self.sent.iteritems()
+                     if now - sent_at < self.dedupe_window}
+        for key in batch:
+            self.sent[key] = now
+        return batch
+
+
+activity_buffer = ActivityBuffer()
+
+
+_pixel_data = None
+
+
+def get_pixel_contents(paths=None):
+    """Return the bytes of the pixel image, read once per process."""
+    global _pixel_data
+    if _pixel_data is None:
+        paths = paths or g.paths
+        with open(os.path.join(paths["root"], "public/static/pixel.png")) as f:
+            _pixel_data = f.read()
+    return _pixel_data
+
+
+def _is_local_address(ip):
+    return ip == "127.0.0.1"
+
+
+def get_client_ip(environ, app_globals):
+    """Return the client's address the way r2's BaseController works it out.
+
+    Behind the CDN this is the address it passes on, behind a trusted local
+    proxy it's the last entry of X-Forwarded-For, and otherwise it's
+    REMOTE_ADDR. Requests served by PixelApp never reach BaseController, so
+    it has to do this itself to agree with `request.ip`.
+
+    """
+    cdn_ip = app_globals.cdn_provider.get_client_ip(environ)
+    if cdn_ip:
+        return cdn_ip
+
+    remote_addr = environ.get("REMOTE_ADDR", "")
+    forwarded_for = environ.get("HTTP_X_FORWARDED_FOR")
+    if (app_globals.trust_local_proxies and forwarded_for and
+            _is_local_address(remote_addr)):
+        return forwarded_for.split(",")[-1].strip()
+    return remote_addr
+
+
+def make_visitor_id(ip, user_agent):
+    return hashlib.sha1(ip + (user_agent or "")).hexdigest()
+
+
+def make_context_id(event_id):
+    event_id = event_id[:50]  # some very simple poor-man's validation
+    return "LiveUpdateEvent_" + event_id
+
+
+PIXEL_HEADERS = [
+    ("Content-Type", "image/png"),
+    ("Cache-Control", "no-cache, max-age=0"),
+    ("Pragma", "no-cache"),
+    ("Expires", "Thu, 01 Jan 1970 00:00:00 GMT"),
+]
+
+
+class BatchSender(object):
+    """Sends batches of hits to the activity service from its own thread.
+
+    Requests handled by PixelApp never enter Pylons, so the thread sets up
+    its own request context to get at the activity service client. Other
+    background work for the pixel, like flushing the viewer counter, can be
+    run in the same thread with `submit`.
+
+    """
+    max_queued_batches = 100
+
+    def __init__(self, app_globals):
+        self.app_globals = app_globals
+        self.batches = Queue.Queue(self.max_queued_batches)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, fn):
+        """Call fn in the sender's thread."""
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+        try:
+            self.batches.put_nowait(fn)
+        except Queue.Full:
+            pass
+
+    def send(self, batch):
+        self.submit(lambda: self._send_batch(batch))
+
+    def _run(self):
+        pylons.app_globals._push_object(self.app_globals)
+
+        while True:
+            fn = self.batches.get()
+            pylons.tmpl_context._push_object(AttribSafeContextObj())
+            try:
+                fn()
+            except Exception:
+                g.log.exception("failed to send activity")
+            finally:
+                pylons.tmpl_context._pop_object()
+
+    def _send_batch(self, batch):
+        c = pylons.tmpl_context
+        with baseplate_integration.make_server_span("liveupdate.pixel_batch"):
+            if not c.activity_service:
+                return
+
+            for context_id, visitor_id in batch:
+                try:
+                    c.activity_service.record_activity(context_id, visitor_id)
+                except TTransportException:
+                    # the service is unavailable, don't bother with the rest
+                    g.stats.simple_event("liveupdate.activity_batch.dropped")
+                    return
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender(app_globals):
+    """Return the process's BatchSender, creating it on first use.
+
+    Both PixelApp and the Pylons pixel and listing controllers send hits
+    through this one sender, so however slow the activity service gets,
+    hits only ever wait in its bounded queue.
+
+    """
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = BatchSender(app_globals)
+        return _sender
+
+
+class PixelApp(object):
+    """Serve the activity pixel without going through Pylons.
+
+    Requests for /live/{event}/pixel.png are answered directly and anything
+    else is passed on to the wrapped application. Visitors are identified by
+    the same address and user agent as in the Pylons controllers.
+
+    """
+    path_re = re.compile(r"^/live/([^/]+)/pixel\.png$")
+
+    def __init__(self, app):
+        self.app = app
+
+    def _get_sender(self):
+        # the app globals are only created once the wrapped app is loaded
+        return get_sender(pylons.config["pylons.app_globals"])
+
+    def __call__(self, environ, start_response):
+        match = self.path_re.match(environ.get("PATH_INFO", ""))
+        if not match or environ.get("REQUEST_METHOD") != "GET":
+            return self.app(environ, start_response)
+
+        sender = self._get_sender()
+        context_id = make_context_id(match.group(1))
+        visitor_id = make_visitor_id(
+            get_client_ip(environ, sender.app_globals),
+            environ.get("HTTP_USER_AGENT"),
+        )
+
+        batch = activity_buffer.add(context_id, visitor_id)
+        if batch:
+            sender.send(batch)
+
+        live_config = sender.app_globals.live_config
+        if live_config.get("liveupdate_hll_counting", False):
+            if hll.viewer_counter.add(context_id, visitor_id):
+                sender.submit(hll.viewer_counter.flush)
+
+        body = get_pixel_contents(paths=sender.app_globals.paths)
+        headers = PIXEL_HEADERS + [("Content-Length", str(len(body)))]
+        start_response("200 OK", headers)
+        return [body]
+
+
+def make_pixel_filter(app, global_conf, **local_conf):
+    """A paste.filter_app_factory for PixelApp."""
+    return PixelApp(app)
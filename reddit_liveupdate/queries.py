@@ -10,7 +10,10 @@ from r2.models.query_cache import (
     FakeQuery,
 )
 
-from reddit_liveupdate.models import LiveUpdateQueryCache
+from reddit_liveupdate.models import (
+    LiveUpdateLiveEventsIndex,
+    LiveUpdateQueryCache,
+)
 
 
 @cached_query(LiveUpdateQueryCache)
@@ -34,12 +37,26 @@ def create_event(event):
     with CachedQueryMutator() as m:
         m.insert(get_live_events("new", "all"), [event])
 
+    if not event.banned:
+        LiveUpdateLiveEventsIndex.add([event._id])
+
 
 def complete_event(event):
     with CachedQueryMutator() as m:
         m.delete(get_live_events("new", "all"), [event])
         m.insert(get_complete_events("new", "all"), [event])
 
+    LiveUpdateLiveEventsIndex.remove([event._id])
+
+
+def ban_event(event):
+    LiveUpdateLiveEventsIndex.remove([event._id])
+
+
+def approve_event(event):
+    if event.state == "live":
+        LiveUpdateLiveEventsIndex.add([event._id])
+
 
 @cached_query(LiveUpdateQueryCache, filter_fn=filter_thing)
 def get_reported_events():
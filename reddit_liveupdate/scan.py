@@ -0,0 +1,164 @@
+"""Parallel, resumable scans over every row of a Thing's column family.
+
+A full scan with `_all()` walks the whole column family in a single
+sequential iterator and has to start over if it dies. `scan` instead splits
+the partitioner's token space into ranges, optionally handed out to a pool
+of worker processes. Each finished range is checkpointed to disk so that a
+job that crashes or is interrupted picks up where it left off when it's
+re-run.
+
+Ranges are the unit of checkpointing, so a resumed job will redo the ranges
+that were in progress when it died. Processing functions must therefore be
+idempotent, which backfills should be anyway.
+
+"""
+import cPickle as pickle
+import multiprocessing
+import os
+import shutil
+
+from pylons import app_globals as g
+
+
+DEFAULT_RANGE_COUNT = 256
+DEFAULT_PROCESSES = 1
+CHECKPOINT_ROOT = "/tmp/liveupdate_scans"
+
+# the (exclusive) minimum and (inclusive) maximum token of each partitioner
+PARTITIONER_TOKEN_BOUNDS = {
+    "org.apache.cassandra.dht.RandomPartitioner": (-1, 2 ** 127),
+    "org.apache.cassandra.dht.Murmur3Partitioner": (-2 ** 63, 2 ** 63 - 1),
+}
+
+
+# the scan in progress. worker processes are forked and inherit this, so the
+# processing function doesn't need to be picklable (functions defined in
+# scripts run under paster can't be).
+_current_scan = None
+
+
+def get_token_ranges(cf, count):
+    """Split the token space of a column family into `count` ranges.
+
+    Returns a list of (start, finish) token pairs where the start is
+    exclusive and the finish inclusive, as expected by `get_range`.
+
+    """
+    partitioner = cf.pool.execute("describe_partitioner")
+    try:
+        lowest, highest = PARTITIONER_TOKEN_BOUNDS[partitioner]
+    except KeyError:
+        raise ValueError("can't split token space of %s" % partitioner)
+
+    span = highest - lowest
+    boundaries = [lowest + span * i // count for i in xrange(count)]
+    boundaries.append(highest)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def _reset_connections():
+    # connections opened before the fork are shared with the parent process
+    # and must not be used by workers. disposing of them here makes each pool
+    # open fresh connections the first time the worker needs them.
+    for pool in g.cassandra_pools.itervalues():
+        pool.dispose()
+
+
+def _checkpoint_path(checkpoint_dir, range_count, index):
+    return os.path.join(checkpoint_dir, "%d-%d" % (range_count, index))
+
+
+def _read_checkpoint(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _write_checkpoint(path, result):
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temporary_path, path)
+
+
+def _scan_range(task):
+    index, start, finish, checkpoint_path = task
+    thing_cls, process_fn = _current_scan
+
+    rows = thing_cls._cf.get_range(
+        start_token=str(start),
+        finish_token=str(finish),
+        read_consistency_level=thing_cls._read_consistency_level,
+    )
+    things = (thing_cls._from_serialized_columns(key, columns)
+              for key, columns in rows if columns)
+
+    result = process_fn(things)
+    _write_checkpoint(checkpoint_path, result)
+    return index, result
+
+
+def scan(thing_cls, process_fn, name, range_count=DEFAULT_RANGE_COUNT,
+         processes=DEFAULT_PROCESSES, checkpoint_root=CHECKPOINT_ROOT):
+    """Call `process_fn` with an iterator of the things in each token range.
+
+    `name` identifies the job's checkpoints; re-running a job with the same
+    name after a failure skips the ranges that were already finished. The
+    checkpoints are removed once every range is done.
+
+    Returns the values returned by `process_fn` for each range, in token
+    order. They're also checkpointed, so they must be picklable.
+
+    By default everything runs in the calling process. Worker processes
+    only get fresh Cassandra connections after they're forked, so only use
+    more `processes` if `process_fn` doesn't use anything else, like
+    memcached (which Things use when they're saved).
+
+    """
+    global _current_scan
+
+    checkpoint_dir = os.path.join(checkpoint_root, name)
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    ranges = get_token_ranges(thing_cls._cf, range_count)
+    results = {}
+    tasks = []
+    for index, (start, finish) in enumerate(ranges):
+        path = _checkpoint_path(checkpoint_dir, range_count, index)
+        if os.path.exists(path):
+            results[index] = _read_checkpoint(path)
+        else:
+            tasks.append((index, start, finish, path))
+
+    if results:
+        g.log.info("%s: resuming with %d of %d ranges already done",
+                   name, len(results), range_count)
+
+    _current_scan = (thing_cls, process_fn)
+    try:
+        if processes > 1:
+            pool = multiprocessing.Pool(
+                processes, initializer=_reset_connections)
+            try:
+                for index, result in pool.imap_unordered(_scan_range, tasks):
+                    results[index] = result
+                    g.log.info("%s: finished range %d (%d of %d)",
+                               name, index, len(results), range_count)
+            except:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        else:
+            for task in tasks:
+                index, result = _scan_range(task)
+                results[index] = result
+                g.log.info("%s: finished range %d (%d of %d)",
+                           name, index, len(results), range_count)
+    finally:
+        _current_scan = None
+
+    shutil.rmtree(checkpoint_dir)
+    return [results[index] for index in xrange(range_count)]
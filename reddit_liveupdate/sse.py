@@ -0,0 +1,319 @@
+"""Server-Sent Events delivery of live thread messages.
+
+This is a fallback for clients that can't use websockets, e.g. because a
+proxy blocks them. The same messages that are broadcast to websockets are
+written to the response as they happen, which is far cheaper than having
+those clients poll the listing.
+
+Each process has a single Hub which subscribes to the broadcast bus once
+per live thread that has any connections open and fans the messages out to
+each of them. The bus that carries broadcasts in production is AmqpBus;
+LocalBus is an in-process stand-in for tests and development.
+
+A connection stays open for minutes, so streams aren't served by Pylons,
+where each would hold a synchronous worker the whole time. StreamApp serves
+them instead and is meant to run in its own server with cooperative (e.g.
+gevent) workers, to which the load balancer sends /live/{thread}/stream.
+
+"""
+import collections
+import json
+import Queue
+import re
+import socket
+import threading
+import time
+
+import pylons
+
+from amqplib import client_0_8 as amqp
+from pylons import app_globals as g
+from pylons.util import AttribSafeContextObj
+
+from r2.lib.db import tdb_cassandra
+
+
+# how often to send a comment to keep idle connections from being reaped
+HEARTBEAT_INTERVAL = 15
+
+# how long to keep a single connection open. clients reconnect on their own
+# and can catch up with /live/{thread}/since.
+MAX_CONNECTION_AGE = 10 * 60
+
+# how many messages may be waiting for a connection before it is dropped
+MAX_QUEUED_MESSAGES = 100
+
+# messages after which a thread will never send anything again
+FINAL_MESSAGE_TYPES = ("complete",)
+
+
+class LocalBus(object):
+    """An in-process broadcast bus."""
+    def __init__(self):
+        self.callbacks = {}
+
+    def subscribe(self, event_id, callback):
+        self.callbacks[event_id] = callback
+
+    def unsubscribe(self, event_id):
+        self.callbacks.pop(event_id, None)
+
+    def publish(self, event_id, type, payload):
+        callback = self.callbacks.get(event_id)
+        if callback:
+            callback(event_id, type, payload)
+
+
+class AmqpBus(object):
+    """Receives the websocket broadcasts from their amqp exchange.
+
+    A single consumer thread reads from a queue that is only bound to the
+    namespaces of subscribed threads, so the process doesn't receive the
+    broadcasts of every other thread. amqp channels can't be shared between
+    threads, so the consumer thread makes the bindings itself, checking for
+    changes to the subscriptions every `poll_interval` seconds.
+
+    """
+    exchange = "sutro"
+    namespace_prefix = "/live/"
+    poll_interval = 1
+
+    def __init__(self, connection_args, log):
+        self.connection_args = connection_args
+        self.log = log
+        self.callbacks = {}
+        self.lock = threading.Lock()
+        self.consumer = None
+
+    def subscribe(self, event_id, callback):
+        with self.lock:
+            self.callbacks[event_id] = callback
+
+            if not self.consumer:
+                self.consumer = threading.Thread(target=self._consume)
+                self.consumer.daemon = True
+                self.consumer.start()
+
+    def unsubscribe(self, event_id):
+        with self.lock:
+            self.callbacks.pop(event_id, None)
+
+    def _consume(self):
+        while True:
+            try:
+                self._consume_until_disconnected()
+            except Exception:
+                self.log.exception("lost connection to broadcast exchange")
+                time.sleep(1)
+
+    def _consume_until_disconnected(self):
+        connection = amqp.Connection(**self.connection_args)
+        try:
+            channel = connection.channel()
+            queue, _, _ = channel.queue_declare(
+                exclusive=True, auto_delete=True)
+            channel.basic_consume(
+                queue=queue, no_ack=True, callback=self._on_message)
+
+            bound = set()
+            while True:
+                self._update_bindings(channel, queue, bound)
+                try:
+                    connection.drain_events(timeout=self.poll_interval)
+                except socket.timeout:
+                    pass
+        finally:
+            connection.close()
+
+    def _update_bindings(self, channel, queue, bound):
+        """Bind the queue to the subscribed threads and unbind the rest.
+
+        `bound` is the set of event ids the queue is currently bound to and
+        is updated to match the subscriptions.
+
+        """
+        with self.lock:
+            subscribed = set(self.callbacks)
+
+        for event_id in subscribed - bound:
+            channel.queue_bind(queue=queue, exchange=self.exchange,
+                               routing_key=self.namespace_prefix + event_id)
+            bound.add(event_id)
+
+        for event_id in bound - subscribed:
+            channel.queue_unbind(queue=queue, exchange=self.exchange,
+                                 routing_key=self.namespace_prefix + event_id)
+            bound.discard(event_id)
+
+    def _on_message(self, message):
+        namespace = message.delivery_info["routing_key"]
+        if not namespace.startswith(self.namespace_prefix):
+            return
+        event_id = namespace[len(self.namespace_prefix):]
+
+        with self.lock:
+            callback = self.callbacks.get(event_id)
+
+        if callback:
+            frame = json.loads(message.body)
+            callback(event_id, frame["type"], frame["payload"])
+
+
+class Listener(object):
+    """The queue of messages waiting to be sent on one connection."""
+    def __init__(self, max_queued=MAX_QUEUED_MESSAGES):
+        self.messages = Queue.Queue(max_queued)
+        self.overflowed = False
+
+    def put(self, type, payload):
+        try:
+            self.messages.put_nowait((type, payload))
+        except Queue.Full:
+            # the client isn't keeping up. rather than buffer without bound
+            # the connection is closed and the client can reconnect and catch
+            # up from the change journal.
+            self.overflowed = True
+
+    def get(self, timeout):
+        return self.messages.get(timeout=timeout)
+
+
+class Hub(object):
+    """Fans out messages from a bus to the listeners of this process."""
+    def __init__(self, bus):
+        self.bus = bus
+        self.lock = threading.Lock()
+        self.listeners = collections.defaultdict(set)
+
+    def subscribe(self, event_id):
+        listener = Listener()
+        with self.lock:
+            if not self.listeners[event_id]:
+                self.bus.subscribe(event_id, self._dispatch)
+            self.listeners[event_id].add(listener)
+        return listener
+
+    def unsubscribe(self, event_id, listener):
+        with self.lock:
+            listeners = self.listeners[event_id]
+            listeners.discard(listener)
+            if not listeners:
+                del self.listeners[event_id]
+                self.bus.unsubscribe(event_id)
+
+    def _dispatch(self, event_id, type, payload):
+        with self.lock:
+            listeners = list(self.listeners.get(event_id, ()))
+
+        for listener in listeners:
+            listener.put(type, payload)
+
+
+def format_message(type, payload):
+    return "event: %s\ndata: %s\n\n" % (type, json.dumps(payload))
+
+
+def stream_messages(hub, event_id, heartbeat_interval=HEARTBEAT_INTERVAL,
+                    max_age=MAX_CONNECTION_AGE):
+    """Yield the text of an SSE response for a thread's messages."""
+    listener = hub.subscribe(event_id)
+    deadline = time.time() + max_age
+
+    try:
+        yield "retry: 5000\n\n"
+
+        while not listener.overflowed and time.time() < deadline:
+            try:
+                type, payload = listener.get(timeout=heartbeat_interval)
+            except Queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+
+            yield format_message(type, payload)
+
+            if type in FINAL_MESSAGE_TYPES:
+                break
+    finally:
+        hub.unsubscribe(event_id, listener)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """Return this process's hub, connected to the amqp broadcast bus."""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            bus = AmqpBus(
+                connection_args={
+                    "host": g.amqp_host,
+                    "userid": g.amqp_user,
+                    "password": g.amqp_pass,
+                    "virtual_host": g.amqp_virtual_host,
+                },
+                log=g.log,
+            )
+            _hub = Hub(bus)
+        return _hub
+
+
+STREAM_HEADERS = [
+    ("Content-Type", "text/event-stream"),
+    ("Cache-Control", "no-cache"),
+    # keep nginx from buffering the stream
+    ("X-Accel-Buffering", "no"),
+]
+
+
+class StreamApp(object):
+    """Serve /live/{thread}/stream without going through Pylons.
+
+    Anything else is passed on to the wrapped application. See the module
+    docstring for how this should be deployed.
+
+    """
+    path_re = re.compile(r"^/live/([^/]+)/stream$")
+
+    def __init__(self, app):
+        self.app = app
+
+    def _is_streamable(self, event_id):
+        from reddit_liveupdate.models import LiveUpdateEvent
+
+        if not g.live_config.get("liveupdate_sse_enabled", False):
+            return False
+
+        try:
+            event = LiveUpdateEvent._byID(event_id)
+        except tdb_cassandra.NotFound:
+            return False
+        return event.state == "live" and not event.banned
+
+    def __call__(self, environ, start_response):
+        match = self.path_re.match(environ.get("PATH_INFO", ""))
+        if not match or environ.get("REQUEST_METHOD") != "GET":
+            return self.app(environ, start_response)
+
+        event_id = match.group(1)
+
+        # the app globals are only created once the wrapped app is loaded
+        pylons.app_globals._push_object(pylons.config["pylons.app_globals"])
+        pylons.tmpl_context._push_object(AttribSafeContextObj())
+        try:
+            if not self._is_streamable(event_id):
+                start_response("404 Not Found", [])
+                return []
+            hub = get_hub()
+        finally:
+            pylons.tmpl_context._pop_object()
+            pylons.app_globals._pop_object()
+
+        start_response("200 OK", STREAM_HEADERS)
+        return stream_messages(hub, event_id)
+
+
+def make_stream_filter(app, global_conf, **local_conf):
+    """A paste.filter_app_factory for StreamApp."""
+    return StreamApp(app)
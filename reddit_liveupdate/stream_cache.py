@@ -0,0 +1,130 @@
+"""Caching of the newest updates in each live thread's stream.
+
+The first page of a popular thread is requested far more often than it
+changes, so the raw columns at the head of the stream (and the newest
+tombstones needed to filter them) are kept in a small process-local cache
+and, optionally, in memcached as a shared second tier.
+
+Writes to the stream invalidate both tiers. Other processes can't see the
+invalidation of their local tier, and a concurrent read can refill the shared
+tier with what it read before the write, so entries are also stored with the
+event's stream token at the time they were fetched. Every write to the stream
+changes the token, so an entry with a different token than the event being
+served is treated as a miss. This keeps what's served consistent with the
+token listings use as their ETag.
+
+"""
+import threading
+import time
+
+from pylons import app_globals as g
+
+
+# how many of the newest columns to cache for each stream
+HEAD_SIZE = 100
+
+# how long an entry may live in each tier, in seconds
+LOCAL_TTL = 2
+SHARED_TTL = 10
+
+# the maximum number of streams to hold in the local tier
+LOCAL_MAX_ENTRIES = 1000
+
+
+class _LocalCache(object):
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                expires, value = self.entries[key]
+            except KeyError:
+                return None
+
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries = {k: v for k, v in self.entries.iteritems()
+                                if v[0] >= now}
+            if len(self.entries) >= self.max_entries:
+                self.entries.clear()
+            self.entries[key] = (now + self.ttl, value)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+_local_cache = _LocalCache(ttl=LOCAL_TTL, max_entries=LOCAL_MAX_ENTRIES)
+
+
+def _use_shared_tier():
+    return g.live_config.get("liveupdate_head_cache_memcache", False)
+
+
+def _make_key(kind, event_id):
+    # versioned because entries used to be stored without their token
+    return "liveupdate_%s_v2_%s" % (kind, event_id)
+
+
+def _get(kind, event_id, token, fetch_fn):
+    key = _make_key(kind, event_id)
+
+    entry = _local_cache.get(key)
+    if entry is not None and entry[0] == token:
+        g.stats.simple_event("liveupdate.%s_cache.local_hit" % kind)
+        return entry[1]
+
+    if _use_shared_tier():
+        entry = g.cache.get(key)
+        if entry is not None and entry[0] == token:
+            g.stats.simple_event("liveupdate.%s_cache.shared_hit" % kind)
+            _local_cache.set(key, entry)
+            return entry[1]
+
+    g.stats.simple_event("liveupdate.%s_cache.miss" % kind)
+    value = fetch_fn(event_id)
+    entry = (token, value)
+    _local_cache.set(key, entry)
+    if _use_shared_tier():
+        g.cache.set(key, entry, time=SHARED_TTL)
+    return value
+
+
+def get_head(event_id, token, fetch_fn):
+    """Return the cached head of a stream, populating the cache on a miss.
+
+    `token` is the event's current stream token. `fetch_fn` is called with
+    the event id when neither tier has the head for that token and must
+    return a list of (column name, raw column value) tuples.
+
+    """
+    return _get("head", event_id, token, fetch_fn)
+
+
+def get_tombstones(event_id, token, fetch_fn):
+    """Return the cached newest tombstones of a stream.
+
+    `fetch_fn` is called with the event id on a miss and must return a dict
+    of update id to tombstone reason.
+
+    """
+    return _get("tombstones", event_id, token, fetch_fn)
+
+
+def invalidate(event_id):
+    keys = [_make_key(kind, event_id) for kind in ("head", "tombstones")]
+    for key in keys:
+        _local_cache.delete(key)
+    if _use_shared_tier():
+        g.cache.delete_multi(keys)
@@ -0,0 +1,81 @@
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate import models
+
+
+class TestActivityStats(RedditTestCase):
+    def test_add(self):
+        stats = models.ActivityStats()
+        for value in (10, 4, 7):
+            stats.add(value)
+
+        bucket = stats.to_bucket(3600)
+        self.assertEqual(bucket.min, 4)
+        self.assertEqual(bucket.max, 10)
+        self.assertEqual(bucket.avg, 7.0)
+
+    def test_serialization_round_trip(self):
+        stats = models.ActivityStats()
+        stats.add(3)
+        stats.add(5)
+
+        parsed = models.ActivityStats.parse(stats.serialize())
+        self.assertEqual(parsed.to_bucket(0), stats.to_bucket(0))
+
+    def test_parse_missing(self):
+        stats = models.ActivityStats.parse(None)
+        stats.add(2)
+        self.assertEqual((stats.min, stats.max), (2, 2))
+
+    def test_buckets(self):
+        self.assertEqual(models._get_activity_bucket(7199.5, "hour"), 3600)
+        self.assertEqual(models._get_activity_bucket(86399, "day"), 0)
+
+
+class TestWriteRows(RedditTestCase):
+    def test_batch_succeeds(self):
+        written = []
+        failures = models.write_rows(
+            ["a", "b"], written.extend, lambda key: self.fail())
+        self.assertEqual(failures, {})
+        self.assertEqual(written, ["a", "b"])
+
+    def test_falls_back_to_single_rows(self):
+        error = IOError("timed out")
+
+        def write_all(keys):
+            raise error
+
+        def write_one(key):
+            if key == "b":
+                raise error
+            written.append(key)
+
+        written = []
+        failures = models.write_rows(["a", "b", "c"], write_all, write_one)
+        self.assertEqual(failures, {"b": error})
+        self.assertEqual(written, ["a", "c"])
+
+
+class TestRecordActivityMulti(RedditTestCase):
+    def setUp(self):
+        self.history = models.LiveUpdateActivityHistoryByEvent
+        self.autopatch(self.history, "_cf")
+        self.autopatch(models.LiveUpdateActivityRollupsByEvent,
+                       "record_multi", return_value={})
+        self.set_values = self.autopatch(self.history, "_set_values")
+
+    def test_retry_rewrites_same_sample(self):
+        def set_values(event_id, columns, batch=None):
+            if batch and event_id == "b":
+                raise IOError("timed out")
+        self.set_values.side_effect = set_values
+
+        failures = self.history.record_activity_multi({"a": 10, "b": 20})
+
+        self.assertEqual(failures, {})
+        written = {}
+        for (event_id, columns), kwargs in self.set_values.call_args_list:
+            written.setdefault(event_id, set()).update(columns.items())
+        self.assertEqual(len(written["a"]), 1)
+        self.assertEqual(len(written["b"]), 1)
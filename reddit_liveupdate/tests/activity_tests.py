@@ -0,0 +1,190 @@
+from mock import MagicMock
+
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate import activity, models
+
+
+class TestDiffActiveEvents(RedditTestCase):
+    stored = {
+        "LiveUpdateEvent_a": 50,
+        "LiveUpdateEvent_b": 20,
+        "LiveUpdateEvent_c": 10,
+    }
+
+    def test_unchanged(self):
+        top = [("a", 50, False), ("b", 20, True), ("c", 10, True)]
+        changed, removed = activity._diff_active_events(self.stored, top)
+        self.assertEqual(changed, [])
+        self.assertEqual(removed, [])
+
+    def test_changed(self):
+        top = [("a", 50, False), ("b", 25, True), ("c", 10, True)]
+        changed, removed = activity._diff_active_events(self.stored, top)
+        self.assertEqual(changed, [("b", 25, True)])
+        self.assertEqual(removed, [])
+
+    def test_dropped(self):
+        top = [("a", 50, False), ("b", 20, True)]
+        changed, removed = activity._diff_active_events(self.stored, top)
+        self.assertEqual(changed, [])
+        self.assertEqual(removed, ["c"])
+
+    def test_added(self):
+        top = [("a", 50, False), ("d", 30, True), ("b", 20, True),
+               ("c", 10, True)]
+        changed, removed = activity._diff_active_events(self.stored, top)
+        self.assertEqual(changed, [("d", 30, True)])
+        self.assertEqual(removed, [])
+
+    def test_sort_values_as_floats(self):
+        stored = {"LiveUpdateEvent_a": 50.0}
+        changed, removed = activity._diff_active_events(
+            stored, [("a", 50, False)])
+        self.assertEqual((changed, removed), ([], []))
+
+
+class TestUpdateActiveEvents(RedditTestCase):
+    def setUp(self):
+        self.g = self.autopatch(activity, "g")
+        self.query = MagicMock(name="query")
+        self.query.data = [
+            ("LiveUpdateEvent_a", 50),
+            ("LiveUpdateEvent_b", 20),
+        ]
+        self.autopatch(activity, "get_active_events", return_value=self.query)
+        mutator_cls = self.autopatch(activity, "CachedQueryMutator")
+        self.mutator = mutator_cls.return_value.__enter__.return_value
+        self.autopatch(activity.LiveUpdateEvent, "_activity_thing",
+                       side_effect=lambda *entry: entry)
+
+    def test_full_replace_when_due(self):
+        self.g.cache.get.return_value = None
+        top = [("a", 50, False), ("b", 20, True)]
+
+        activity._update_active_events(top)
+
+        self.mutator.replace.assert_called_once_with(
+            self.query, top, ttl=activity.ACTIVE_EVENTS_TTL)
+        self.assertFalse(self.mutator.insert.called)
+        self.g.cache.set.assert_called_once_with(
+            activity.ACTIVE_EVENTS_REPLACED_KEY, True,
+            time=activity.FULL_REPLACE_INTERVAL)
+
+    def test_incremental(self):
+        self.g.cache.get.return_value = True
+
+        activity._update_active_events([("a", 60, False), ("c", 5, True)])
+
+        self.assertFalse(self.mutator.replace.called)
+        self.mutator.insert.assert_called_once_with(
+            self.query, [("a", 60, False), ("c", 5, True)],
+            ttl=activity.ACTIVE_EVENTS_TTL)
+        self.mutator.delete.assert_called_once_with(
+            self.query, [("b", 0, False)])
+
+    def test_unchanged_skips_write(self):
+        self.g.cache.get.return_value = True
+
+        activity._update_active_events([("a", 50, False), ("b", 20, True)])
+
+        self.assertFalse(self.mutator.replace.called)
+        self.assertFalse(self.mutator.insert.called)
+        self.assertFalse(self.mutator.delete.called)
+
+
+class TestEventShard(RedditTestCase):
+    def test_stable(self):
+        # every process must agree, so this can't depend on e.g. hash()
+        self.assertEqual(
+            [models.get_event_shard(event_id, 4)
+             for event_id in ("a", "ts4r8m6pq5v3", "zz")],
+            [3, 1, 1])
+
+    def test_in_range_and_spread(self):
+        event_ids = ["event%d" % i for i in xrange(1000)]
+        shards = [models.get_event_shard(event_id, 8)
+                  for event_id in event_ids]
+        self.assertEqual(set(shards), set(xrange(8)))
+        for shard in xrange(8):
+            self.assertGreater(shards.count(shard), 50)
+
+    def test_single_shard(self):
+        self.assertEqual(models.get_event_shard("abc", 1), 0)
+
+
+class TestCountActivity(RedditTestCase):
+    def setUp(self):
+        self.g = self.autopatch(activity, "g")
+        self.g.live_config = {}
+        self.activity_service = MagicMock()
+        retrying = self.activity_service.retrying.return_value
+        self.service = retrying.__enter__.return_value
+        self.service.count_activity_multi.return_value = "service counts"
+        self.counter = self.autopatch(activity.hll, "viewer_counter")
+        self.counter.count_multi.return_value = "hll counts"
+
+    def _count(self):
+        return activity._count_activity(["a"], self.activity_service)
+
+    def test_service(self):
+        self.assertEqual(self._count(), "service counts")
+
+    def test_hll(self):
+        self.g.live_config = {
+            "liveupdate_viewer_count_source": "hll",
+            "liveupdate_hll_counting": True,
+        }
+        self.assertEqual(self._count(), "hll counts")
+        self.assertFalse(self.service.count_activity_multi.called)
+
+    def test_hll_without_counting(self):
+        self.g.live_config = {"liveupdate_viewer_count_source": "hll"}
+        self.assertEqual(self._count(), "service counts")
+        self.assertFalse(self.counter.count_multi.called)
+
+
+class FakeEvent(object):
+    def __init__(self, id, state="live", banned=False):
+        self._id = id
+        self.state = state
+        self.banned = banned
+
+
+class TestLiveEventsIndex(RedditTestCase):
+    def setUp(self):
+        self.autopatch(models, "g")
+        self.events = {
+            "a": FakeEvent("a"),
+            "b": FakeEvent("b", state="complete"),
+            "c": FakeEvent("c", banned=True),
+            "d": FakeEvent("d"),
+        }
+        self.autopatch(
+            models.LiveUpdateEvent, "_byID",
+            side_effect=lambda ids, return_dict: [
+                self.events[id] for id in ids])
+        self.all_events = self.autopatch(
+            models.LiveUpdateEvent, "_all",
+            side_effect=lambda: iter(self.events.values()))
+        self.get_ids = self.autopatch(
+            models.LiveUpdateLiveEventsIndex, "get_ids")
+
+    def _get_event_ids(self, *args):
+        return sorted(event._id for event in
+                      models.LiveUpdateLiveEventsIndex.get_events(*args))
+
+    def test_index(self):
+        self.get_ids.return_value = ["a", "b"]
+        self.assertEqual(self._get_event_ids(), ["a"])
+        self.assertFalse(self.all_events.called)
+
+    def test_empty_index_scans_all_events(self):
+        self.get_ids.return_value = []
+        self.assertEqual(self._get_event_ids(), ["a", "d"])
+
+    def test_shards(self):
+        self.get_ids.return_value = ["a", "b", "c", "d"]
+        shards = [self._get_event_ids(shard, 2) for shard in (0, 1)]
+        self.assertEqual(sorted(shards[0] + shards[1]), ["a", "d"])
+        self.assertFalse(set(shards[0]) & set(shards[1]))
@@ -0,0 +1,57 @@
+import json
+
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate import encoding
+
+
+class TestEncoding(RedditTestCase):
+    def test_round_trip(self):
+        data = {
+            "author_id": 1234,
+            "body": u"hello \u2603",
+            "media_objects": [{"type": "twitter.com"}],
+        }
+        self.assertEqual(encoding.decode(encoding.encode(data)), data)
+
+    def test_unknown_fields_are_kept_by_name(self):
+        data = {"author_id": 1, "some_new_field": "value"}
+        self.assertEqual(encoding.decode(encoding.encode(data)), data)
+
+    def test_defaults_are_omitted(self):
+        defaults = {"deleted": False, "media_objects": []}
+        encoded = encoding.encode(
+            {"author_id": 1, "deleted": False, "media_objects": []},
+            defaults=defaults,
+        )
+        self.assertEqual(encoding.decode(encoded), {"author_id": 1})
+
+    def test_smaller_than_json(self):
+        data = {"author_id": 1234, "body": "hi", "_spam": True}
+        self.assertLess(len(encoding.encode(data)), len(json.dumps(data)))
+
+    def test_reads_legacy_json(self):
+        data = {"author_id": 1234, "body": "hi", "deleted": True}
+        self.assertEqual(encoding.decode(unicode(json.dumps(data))), data)
+
+    def test_is_current(self):
+        self.assertTrue(encoding.is_current(encoding.encode({"body": "x"})))
+        self.assertFalse(encoding.is_current(u'{"body": "x"}'))
+
+    def test_flags_round_trip(self):
+        data = {"author_id": 1, "deleted": True, "stricken": True}
+        encoded = encoding.encode(data)
+        self.assertEqual(encoding.decode(encoded), data)
+        self.assertEqual(
+            encoding.decode_flags(encoded),
+            {"deleted": True, "_spam": False, "stricken": True},
+        )
+
+    def test_no_flags_for_old_formats(self):
+        self.assertIsNone(encoding.decode_flags(u'{"deleted": true}'))
+        self.assertIsNone(encoding.decode_flags(u'\x01[4,true]'))
+        self.assertEqual(encoding.decode(u'\x01[4,true]'), {"deleted": True})
+
+    def test_unknown_version(self):
+        with self.assertRaises(encoding.UnknownEncodingError):
+            encoding.decode(u"\x7fwhat")
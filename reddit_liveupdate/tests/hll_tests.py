@@ -0,0 +1,88 @@
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate.hll import (
+    HyperLogLog,
+    InMemorySketchStore,
+    ViewerCounter,
+)
+
+
+class TestHyperLogLog(RedditTestCase):
+    def test_empty(self):
+        self.assertEqual(HyperLogLog().count(), 0)
+
+    def test_duplicates_ignored(self):
+        sketch = HyperLogLog()
+        for i in xrange(100):
+            sketch.add("visitor")
+        self.assertEqual(sketch.count(), 1)
+
+    def test_estimate(self):
+        sketch = HyperLogLog()
+        for i in xrange(10000):
+            sketch.add("visitor-%d" % i)
+        self.assertAlmostEqual(sketch.count(), 10000, delta=1000)
+
+    def test_merge(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        for i in xrange(1000):
+            a.add("visitor-%d" % i)
+            b.add("visitor-%d" % (i + 500))
+        a.merge(b)
+        self.assertAlmostEqual(a.count(), 1500, delta=150)
+
+    def test_serialize(self):
+        sketch = HyperLogLog()
+        sketch.add("visitor")
+        copy = HyperLogLog.deserialize(sketch.serialize())
+        self.assertEqual(copy.registers, sketch.registers)
+
+
+class TestViewerCounter(RedditTestCase):
+    def setUp(self):
+        self.store = InMemorySketchStore()
+
+    def _counter(self):
+        return ViewerCounter(self.store, slot_seconds=60, window=300)
+
+    def test_merges_processes(self):
+        first, second = self._counter(), self._counter()
+        for i in xrange(200):
+            first.add("thread", "visitor-%d" % i, now=1000)
+            second.add("thread", "visitor-%d" % (i + 100), now=1000)
+        first.flush(now=1000)
+        second.flush(now=1000)
+
+        counts = first.count_multi(["thread", "other"], now=1000)
+        self.assertAlmostEqual(counts["thread"].count, 300, delta=30)
+        self.assertFalse(counts["thread"].is_fuzzed)
+        self.assertEqual(counts["other"].count, 0)
+
+    def test_repeated_flush(self):
+        counter = self._counter()
+        for i in xrange(200):
+            counter.add("thread", "visitor-%d" % i, now=1000)
+        counter.flush(now=1000)
+        counter.flush(now=1000)
+        counts = counter.count_multi(["thread"], now=1000)
+        self.assertAlmostEqual(counts["thread"].count, 200, delta=20)
+
+    def test_window(self):
+        counter = self._counter()
+        for i in xrange(200):
+            counter.add("thread", "visitor-%d" % i, now=1000)
+        counter.flush(now=1000)
+        # the old slot is dropped from the local sketches once flushed
+        counter.flush(now=1100)
+        self.assertEqual(counter.local, {})
+
+        self.assertTrue(counter.count_multi(["thread"], now=1200)["thread"].count)
+        self.assertEqual(
+            counter.count_multi(["thread"], now=1400)["thread"].count, 0)
+
+    def test_flush_due(self):
+        counter = self._counter()
+        counter.last_flush = 1000
+        self.assertFalse(counter.add("thread", "visitor", now=1001))
+        self.assertTrue(counter.add("thread", "visitor", now=1005))
+        self.assertFalse(counter.add("thread", "visitor", now=1006))
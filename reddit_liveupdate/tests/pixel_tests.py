@@ -0,0 +1,104 @@
+from mock import MagicMock
+
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate import pixel
+from reddit_liveupdate.pixel import ActivityBuffer
+
+
+class TestActivityBuffer(RedditTestCase):
+    def setUp(self):
+        self.buffer = ActivityBuffer(
+            flush_size=3, flush_interval=5, dedupe_window=60)
+        self.buffer.last_flush = 1000
+
+    def test_flush_on_size(self):
+        self.assertIsNone(self.buffer.add("a", "1", now=1000))
+        self.assertIsNone(self.buffer.add("a", "2", now=1000))
+        batch = self.buffer.add("b", "1", now=1000)
+        self.assertEqual(sorted(batch), [("a", "1"), ("a", "2"), ("b", "1")])
+
+    def test_flush_on_interval(self):
+        self.assertIsNone(self.buffer.add("a", "1", now=1001))
+        batch = self.buffer.add("a", "2", now=1005)
+        self.assertEqual(sorted(batch), [("a", "1"), ("a", "2")])
+
+    def test_dedupe(self):
+        self.buffer.add("a", "1", now=1000)
+        self.assertEqual(self.buffer.add("a", "1", now=1005), [("a", "1")])
+
+        # repeats within the window aren't sent again
+        self.assertIsNone(self.buffer.add("a", "1", now=1020))
+        self.assertIsNone(self.buffer.add("a", "1", now=1030))
+        self.assertEqual(self.buffer.pending, set())
+
+        # but are once it has passed
+        self.assertEqual(self.buffer.add("a", "1", now=1070), [("a", "1")])
+
+
+class TestClientIp(RedditTestCase):
+    def setUp(self):
+        self.app_globals = MagicMock()
+        self.app_globals.cdn_provider.get_client_ip.return_value = None
+        self.app_globals.trust_local_proxies = True
+
+    def test_remote_addr(self):
+        environ = {"REMOTE_ADDR": "1.2.3.4"}
+        self.assertEqual(
+            pixel.get_client_ip(environ, self.app_globals), "1.2.3.4")
+
+    def test_cdn(self):
+        self.app_globals.cdn_provider.get_client_ip.return_value = "5.6.7.8"
+        environ = {"REMOTE_ADDR": "1.2.3.4"}
+        self.assertEqual(
+            pixel.get_client_ip(environ, self.app_globals), "5.6.7.8")
+
+    def test_forwarded_by_local_proxy(self):
+        environ = {
+            "REMOTE_ADDR": "127.0.0.1",
+            "HTTP_X_FORWARDED_FOR": "10.0.0.1, 5.6.7.8",
+        }
+        self.assertEqual(
+            pixel.get_client_ip(environ, self.app_globals), "5.6.7.8")
+
+    def test_forwarded_untrusted(self):
+        environ = {
+            "REMOTE_ADDR": "1.2.3.4",
+            "HTTP_X_FORWARDED_FOR": "5.6.7.8",
+        }
+        self.assertEqual(
+            pixel.get_client_ip(environ, self.app_globals), "1.2.3.4")
+
+        self.app_globals.trust_local_proxies = False
+        environ["REMOTE_ADDR"] = "127.0.0.1"
+        self.assertEqual(
+            pixel.get_client_ip(environ, self.app_globals), "127.0.0.1")
+
+
+class TestPixelApp(RedditTestCase):
+    def setUp(self):
+        self.sender = MagicMock()
+        self.sender.app_globals.cdn_provider.get_client_ip.return_value = None
+        self.sender.app_globals.trust_local_proxies = True
+        self.sender.app_globals.live_config = {}
+        self.autopatch(pixel.PixelApp, "_get_sender", return_value=self.sender)
+        self.autopatch(pixel, "get_pixel_contents", return_value="png")
+        self.buffer = self.autopatch(pixel, "activity_buffer")
+        self.buffer.add.return_value = None
+        self.app = pixel.PixelApp(MagicMock())
+
+    def test_forwarded_request(self):
+        environ = {
+            "PATH_INFO": "/live/abc/pixel.png",
+            "REQUEST_METHOD": "GET",
+            "REMOTE_ADDR": "127.0.0.1",
+            "HTTP_X_FORWARDED_FOR": "5.6.7.8",
+            "HTTP_USER_AGENT": "agent",
+        }
+        start_response = MagicMock()
+
+        body = self.app(environ, start_response)
+
+        self.assertEqual(body, ["png"])
+        self.buffer.add.assert_called_once_with(
+            "LiveUpdateEvent_abc", pixel.make_visitor_id("5.6.7.8", "agent"))
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate import scan
+
+
+class FakePool(object):
+    def __init__(self, partitioner):
+        self.partitioner = partitioner
+
+    def execute(self, method):
+        assert method == "describe_partitioner"
+        return self.partitioner
+
+
+class FakeColumnFamily(object):
+    def __init__(self, partitioner, rows_by_token=None):
+        self.pool = FakePool(partitioner)
+        self.rows_by_token = rows_by_token or {}
+
+    def get_range(self, start_token, finish_token, read_consistency_level):
+        start, finish = long(start_token), long(finish_token)
+        for token, key in sorted(self.rows_by_token.iteritems()):
+            if start < token <= finish:
+                yield key, {"value": key}
+
+
+class TestTokenRanges(RedditTestCase):
+    def test_covers_token_space(self):
+        partitioner = "org.apache.cassandra.dht.Murmur3Partitioner"
+        ranges = scan.get_token_ranges(FakeColumnFamily(partitioner), 7)
+
+        self.assertEqual(len(ranges), 7)
+        self.assertEqual(ranges[0][0], -2 ** 63)
+        self.assertEqual(ranges[-1][1], 2 ** 63 - 1)
+        for (start, finish), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertLess(start, finish)
+            self.assertEqual(finish, next_start)
+
+    def test_unsupported_partitioner(self):
+        cf = FakeColumnFamily("org.apache.cassandra.dht.ByteOrderedPartitioner")
+        with self.assertRaises(ValueError):
+            scan.get_token_ranges(cf, 4)
+
+
+class FakeThing(object):
+    _read_consistency_level = None
+
+    def __init__(self, key):
+        self._id = key
+
+    @classmethod
+    def _from_serialized_columns(cls, key, columns):
+        return cls(key)
+
+
+class TestResume(RedditTestCase):
+    def setUp(self):
+        self.autopatch(scan, "g")
+        self.checkpoint_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.checkpoint_root)
+
+        # one row in each of four equal ranges of the murmur3 token space
+        FakeThing._cf = FakeColumnFamily(
+            "org.apache.cassandra.dht.Murmur3Partitioner",
+            {-2 ** 62 - 1: "a", -1: "b", 2 ** 62 - 1: "c", 2 ** 63 - 2: "d"},
+        )
+        self.processed = []
+
+    def _scan(self, fail_on=None):
+        def process(things):
+            keys = [thing._id for thing in things]
+            if fail_on in keys:
+                raise IOError("interrupted")
+            self.processed.extend(keys)
+            return keys
+
+        return scan.scan(FakeThing, process, name="test", range_count=4,
+                         checkpoint_root=self.checkpoint_root)
+
+    def test_resume_skips_finished_ranges(self):
+        with self.assertRaises(IOError):
+            self._scan(fail_on="c")
+        self.assertEqual(self.processed, ["a", "b"])
+
+        self.processed = []
+        results = self._scan()
+        self.assertEqual(self.processed, ["c", "d"])
+        self.assertEqual(results, [["a"], ["b"], ["c"], ["d"]])
+
+    def test_checkpoints_removed_when_done(self):
+        self._scan()
+        self.assertFalse(
+            os.path.exists(os.path.join(self.checkpoint_root, "test")))
+
+        self.processed = []
+        self._scan()
+        self.assertEqual(self.processed, ["a", "b", "c", "d"])
@@ -0,0 +1,146 @@
+import json
+
+from mock import MagicMock
+
+from r2.lib.db import tdb_cassandra
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate import sse
+from reddit_liveupdate.models import LiveUpdateEvent
+
+
+class TestHub(RedditTestCase):
+    def setUp(self):
+        self.bus = sse.LocalBus()
+        self.hub = sse.Hub(self.bus)
+
+    def test_one_bus_subscription_per_event(self):
+        first = self.hub.subscribe("abc")
+        second = self.hub.subscribe("abc")
+        self.assertEqual(self.bus.callbacks.keys(), ["abc"])
+
+        self.hub.unsubscribe("abc", first)
+        self.assertIn("abc", self.bus.callbacks)
+        self.hub.unsubscribe("abc", second)
+        self.assertNotIn("abc", self.bus.callbacks)
+
+    def test_fan_out(self):
+        first = self.hub.subscribe("abc")
+        second = self.hub.subscribe("abc")
+        other = self.hub.subscribe("def")
+
+        self.bus.publish("abc", "strike", "LiveUpdate_1")
+
+        self.assertEqual(first.get(timeout=0), ("strike", "LiveUpdate_1"))
+        self.assertEqual(second.get(timeout=0), ("strike", "LiveUpdate_1"))
+        self.assertTrue(other.messages.empty())
+
+    def test_overflow(self):
+        listener = self.hub.subscribe("abc")
+        for i in xrange(sse.MAX_QUEUED_MESSAGES + 1):
+            self.bus.publish("abc", "activity", {"count": i})
+        self.assertTrue(listener.overflowed)
+
+
+class TestAmqpBindings(RedditTestCase):
+    def setUp(self):
+        self.bus = sse.AmqpBus(connection_args={}, log=MagicMock())
+        # don't start a real consumer thread
+        self.bus.consumer = MagicMock()
+        self.channel = MagicMock()
+        self.bound = set()
+
+    def routing_keys(self, method):
+        return [call[1]["routing_key"] for call in method.call_args_list]
+
+    def test_bind_subscribed_events(self):
+        self.bus.callbacks = {"abc": MagicMock()}
+
+        self.bus._update_bindings(self.channel, "queue", self.bound)
+        self.bus._update_bindings(self.channel, "queue", self.bound)
+
+        self.assertEqual(
+            self.routing_keys(self.channel.queue_bind), ["/live/abc"])
+        self.assertEqual(self.bound, {"abc"})
+
+    def test_unbind_when_last_listener_leaves(self):
+        hub = sse.Hub(self.bus)
+        listener = hub.subscribe("abc")
+        self.bus._update_bindings(self.channel, "queue", self.bound)
+
+        hub.unsubscribe("abc", listener)
+        self.bus._update_bindings(self.channel, "queue", self.bound)
+
+        self.assertEqual(
+            self.routing_keys(self.channel.queue_unbind), ["/live/abc"])
+        self.assertEqual(self.bound, set())
+
+
+class TestStreamApp(RedditTestCase):
+    def setUp(self):
+        self.autopatch(sse, "pylons")
+        self.autopatch(sse, "g", live_config={"liveupdate_sse_enabled": True})
+        self.event = MagicMock(state="live", banned=False)
+        self.byID = self.autopatch(
+            LiveUpdateEvent, "_byID", return_value=self.event)
+        self.autopatch(sse, "get_hub", return_value=sse.Hub(sse.LocalBus()))
+        self.next_app = MagicMock()
+        self.app = sse.StreamApp(self.next_app)
+        self.start_response = MagicMock()
+
+    def request(self, path="/live/abc/stream", method="GET"):
+        environ = {"PATH_INFO": path, "REQUEST_METHOD": method}
+        return self.app(environ, self.start_response)
+
+    def test_pass_through(self):
+        self.request(path="/live/abc/since")
+        self.request(method="POST")
+        self.assertEqual(self.next_app.call_count, 2)
+        self.assertFalse(self.start_response.called)
+
+    def test_stream(self):
+        body = self.request()
+
+        self.start_response.assert_called_once_with(
+            "200 OK", sse.STREAM_HEADERS)
+        self.assertEqual(next(body), "retry: 5000\n\n")
+        self.byID.assert_called_once_with("abc")
+        self.assertFalse(self.next_app.called)
+
+    def test_not_found(self):
+        self.byID.side_effect = tdb_cassandra.NotFound
+        self.assertEqual(self.request(), [])
+        self.start_response.assert_called_once_with("404 Not Found", [])
+
+    def test_not_live(self):
+        self.event.state = "complete"
+        self.assertEqual(self.request(), [])
+        self.start_response.assert_called_once_with("404 Not Found", [])
+
+    def test_disabled(self):
+        sse.g.live_config = {}
+        self.assertEqual(self.request(), [])
+        self.assertFalse(self.byID.called)
+
+
+class TestStreamMessages(RedditTestCase):
+    def test_stream(self):
+        bus = sse.LocalBus()
+        hub = sse.Hub(bus)
+        stream = sse.stream_messages(hub, "abc", heartbeat_interval=0)
+
+        self.assertEqual(next(stream), "retry: 5000\n\n")
+        self.assertEqual(next(stream), ": keepalive\n\n")
+
+        bus.publish("abc", "activity", {"count": 5})
+        bus.publish("abc", "complete", {})
+        bus.publish("abc", "activity", {"count": 6})
+
+        event, data, blank = next(stream).split("\n", 2)
+        self.assertEqual(event, "event: activity")
+        self.assertEqual(json.loads(data[len("data: "):]), {"count": 5})
+        self.assertEqual(next(stream), sse.format_message("complete", {}))
+
+        # the stream ends after the thread completes and stops listening
+        self.assertEqual(list(stream), [])
+        self.assertEqual(bus.callbacks, {})
@@ -0,0 +1,105 @@
+from mock import MagicMock
+
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate import stream_cache
+
+
+class FakeMemcache(object):
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, time=0):
+        self.values[key] = value
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+class TestLocalCache(RedditTestCase):
+    def setUp(self):
+        self.time = self.autopatch(stream_cache.time, "time", return_value=100)
+        self.cache = stream_cache._LocalCache(ttl=2, max_entries=2)
+
+    def test_expiry(self):
+        self.cache.set("a", 1)
+        self.time.return_value = 102
+        self.assertEqual(self.cache.get("a"), 1)
+        self.time.return_value = 102.5
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_delete(self):
+        self.cache.set("a", 1)
+        self.cache.delete("a")
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_max_entries(self):
+        self.cache.set("a", 1)
+        self.time.return_value = 105
+        self.cache.set("b", 2)
+        # the expired entry makes room before anything live is dropped
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), 2)
+        self.assertEqual(self.cache.get("c"), 3)
+
+
+class TestStreamCache(RedditTestCase):
+    def setUp(self):
+        self.g = self.autopatch(stream_cache, "g")
+        self.g.live_config.get.return_value = True
+        self.g.cache = FakeMemcache()
+        self.autopatch(stream_cache, "_local_cache",
+                       stream_cache._LocalCache(ttl=2, max_entries=10))
+        self.fetch = MagicMock(side_effect=lambda event_id: ["head"])
+
+    def test_local_hit(self):
+        self.assertEqual(
+            stream_cache.get_head("abc", "t1", self.fetch), ["head"])
+        self.assertEqual(
+            stream_cache.get_head("abc", "t1", self.fetch), ["head"])
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_shared_hit(self):
+        stream_cache.get_head("abc", "t1", self.fetch)
+        # as seen from another process with nothing in its local tier
+        stream_cache._local_cache.entries.clear()
+        stream_cache.get_head("abc", "t1", self.fetch)
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_shared_tier_disabled(self):
+        self.g.live_config.get.return_value = False
+        stream_cache.get_head("abc", "t1", self.fetch)
+        self.assertEqual(self.g.cache.values, {})
+
+    def test_invalidate(self):
+        stream_cache.get_head("abc", "t1", self.fetch)
+        stream_cache.invalidate("abc")
+        stream_cache.get_head("abc", "t1", self.fetch)
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_stale_token_is_a_miss(self):
+        stream_cache.get_head("abc", "t1", self.fetch)
+
+        # another process's local tier isn't invalidated, and the shared tier
+        # can be refilled by a read that started before the write.
+        self.fetch.side_effect = lambda event_id: ["new head"]
+        self.assertEqual(
+            stream_cache.get_head("abc", "t2", self.fetch), ["new head"])
+
+        stream_cache._local_cache.entries.clear()
+        self.assertEqual(
+            stream_cache.get_head("abc", "t2", self.fetch), ["new head"])
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_kinds_are_separate(self):
+        tombstones_fetch = MagicMock(return_value={"u1": "deleted"})
+        stream_cache.get_head("abc", "t1", self.fetch)
+        self.assertEqual(
+            stream_cache.get_tombstones("abc", "t1", tombstones_fetch),
+            {"u1": "deleted"})
+        self.assertEqual(tombstones_fetch.call_count, 1)
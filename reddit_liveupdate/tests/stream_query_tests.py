@@ -0,0 +1,244 @@
+from mock import MagicMock
+from pycassa.util import convert_time_to_uuid
+
+from r2.tests import RedditTestCase
+
+from reddit_liveupdate import models, stream_cache
+
+
+class FakeEvent(object):
+    def __init__(self, stream_bucketed=False):
+        self._id = "abc"
+        self.stream_bucketed = stream_bucketed
+        self.stream_token = ""
+
+
+class FakeStreamQuery(object):
+    """A newest-first stream query over a list of ids.
+
+    Like the real query, `column_start` is the last item of the previous
+    page and isn't returned again.
+
+    """
+    def __init__(self, ids, count, reverse=False):
+        self.ids = list(reversed(ids)) if reverse else ids
+        self._limit = count
+        self._rules = []
+        self.column_start = None
+
+    def __iter__(self):
+        ids = self.ids
+        if self.column_start:
+            ids = ids[ids.index(self.column_start) + 1:]
+        for id in ids[:self._limit]:
+            yield models.LiveUpdate.from_column(id, "raw")
+
+
+class TestPaging(RedditTestCase):
+    # newest first
+    ids = ["u%02d" % i for i in reversed(xrange(12))]
+
+    def setUp(self):
+        self.autopatch(stream_cache, "HEAD_SIZE", 5)
+        self.autopatch(
+            models.LiveUpdateStream, "get_head",
+            side_effect=lambda event: [(id, "raw") for id in self.ids[:5]])
+        self.autopatch(
+            models.LiveUpdateStream, "query_event",
+            side_effect=lambda event, count, reverse=False:
+                FakeStreamQuery(self.ids, count, reverse))
+        self.event = FakeEvent()
+
+    def _page(self, after, tombstones, num):
+        # built the same way as the listing in GET_listing
+        if after:
+            query = models.LiveUpdateStream.query_event(self.event, count=num)
+            query.column_start = after
+        else:
+            query = models.LiveUpdateHeadQuery(self.event)
+        query = models.TombstoneSkippingQuery(query, tombstones)
+        query._limit = num
+        return [item._id for item in query]
+
+    def _all_pages(self, tombstones, num):
+        seen = []
+        after = None
+        while True:
+            page = self._page(after, tombstones, num)
+            if not page:
+                return seen
+            self.assertLessEqual(len(page), num)
+            seen.extend(page)
+            after = page[-1]
+
+    def test_no_overlap_or_gaps(self):
+        tombstones = {"u10", "u07", "u06", "u02"}
+        for num in (1, 2, 3, 4, 5, 7, 20):
+            expected = [id for id in self.ids if id not in tombstones]
+            self.assertEqual(self._all_pages(tombstones, num), expected)
+
+    def test_first_page_past_head(self):
+        # the head holds 5 updates, so this page continues from the stream
+        tombstones = {"u11", "u08"}
+        self.assertEqual(
+            self._page(None, tombstones, num=6),
+            ["u10", "u09", "u07", "u06", "u05", "u04"])
+
+    def test_head_query_after(self):
+        query = models.LiveUpdateHeadQuery(self.event)
+        query._limit = 3
+        query._after(models.LiveUpdate.from_column("u10", "raw"))
+        self.assertEqual([item._id for item in query], ["u09", "u08", "u07"])
+
+    def test_head_query_reversed(self):
+        query = models.LiveUpdateHeadQuery(self.event)
+        query._reverse()
+        query._limit = 2
+        query._after(models.LiveUpdate.from_column("u09", "raw"))
+        self.assertEqual([item._id for item in query], ["u10", "u11"])
+
+    def test_head_query_reversed_from_past_head(self):
+        query = models.LiveUpdateHeadQuery(self.event)
+        query._reverse()
+        query._limit = 4
+        query._after(models.LiveUpdate.from_column("u05", "raw"))
+        self.assertEqual([item._id for item in query],
+                         ["u06", "u07", "u08", "u09"])
+
+    def test_short_stream(self):
+        self.ids = ["u02", "u01", "u00"]
+        self.assertEqual(self._all_pages({"u01"}, num=2), ["u02", "u00"])
+
+
+class TestStreamRowkeys(RedditTestCase):
+    bucket_seconds = models.LiveUpdateStream._bucket_seconds
+
+    def setUp(self):
+        self.autopatch(models.LiveUpdateStreamBucketsByEvent, "get_buckets",
+                       return_value=[10, 11, 12])
+        self.event = FakeEvent(stream_bucketed=True)
+
+    def _id_at(self, timestamp):
+        return convert_time_to_uuid(timestamp)
+
+    def test_unbucketed(self):
+        event = FakeEvent()
+        self.assertEqual(models.LiveUpdateStream._rowkeys(event), ["abc"])
+        self.assertEqual(
+            models.LiveUpdateStream._rowkey(event, self._id_at(0)), "abc")
+
+    def test_no_start(self):
+        rowkeys = models.LiveUpdateStream._rowkeys
+        self.assertEqual(rowkeys(self.event), ["abc.12", "abc.11", "abc.10"])
+        self.assertEqual(rowkeys(self.event, reverse=True),
+                         ["abc.10", "abc.11", "abc.12"])
+
+    def test_start_at_end_of_bucket(self):
+        start = self._id_at(12 * self.bucket_seconds - 0.001)
+        rowkeys = models.LiveUpdateStream._rowkeys
+        self.assertEqual(rowkeys(self.event, start=start),
+                         ["abc.11", "abc.10"])
+        self.assertEqual(rowkeys(self.event, start=start, reverse=True),
+                         ["abc.11", "abc.12"])
+
+    def test_start_at_beginning_of_bucket(self):
+        start = self._id_at(12 * self.bucket_seconds)
+        rowkeys = models.LiveUpdateStream._rowkeys
+        self.assertEqual(rowkeys(self.event, start=start),
+                         ["abc.12", "abc.11", "abc.10"])
+        self.assertEqual(rowkeys(self.event, start=start, reverse=True),
+                         ["abc.12"])
+
+    def test_rowkey_for_update(self):
+        rowkey = models.LiveUpdateStream._rowkey
+        self.assertEqual(
+            rowkey(self.event, self._id_at(12 * self.bucket_seconds - 0.001)),
+            "abc.11")
+        self.assertEqual(
+            rowkey(self.event, self._id_at(12 * self.bucket_seconds)),
+            "abc.12")
+
+    def test_query_continues_across_buckets(self):
+        rows = {
+            "abc.12": ["u5", "u4"],
+            "abc.11": ["u3", "u2"],
+            "abc.10": ["u1", "u0"],
+        }
+        self.autopatch(
+            models.LiveUpdateStream, "query",
+            side_effect=lambda rowkeys, count, reverse=False:
+                FakeStreamQuery(rows[rowkeys[0]], count))
+        self.autopatch(models, "_get_stream_bucket", return_value=11)
+
+        query = models.BucketedStreamQuery(self.event, count=3)
+        query.column_start = "u3"
+        self.assertEqual([item._id for item in query], ["u2", "u1", "u0"])
+
+    def test_before_continues_across_buckets(self):
+        rows = {
+            "abc.12": ["u5", "u4"],
+            "abc.11": ["u3", "u2"],
+            "abc.10": ["u1", "u0"],
+        }
+        self.autopatch(
+            models.LiveUpdateStream, "query",
+            side_effect=lambda rowkeys, count, reverse=False:
+                FakeStreamQuery(rows[rowkeys[0]], count, reverse))
+        self.autopatch(models, "_get_stream_bucket", return_value=11)
+
+        # built like GET_listing's query for `before`, then reversed again
+        # by the builder
+        query = models.LiveUpdateStream.query_event(
+            self.event, count=3, reverse=True)
+        query._reverse()
+        query._after(models.LiveUpdate.from_column("u2", "raw"))
+        self.assertEqual([item._id for item in query], ["u3", "u4", "u5"])
+
+
+class TestAddUpdate(RedditTestCase):
+    def setUp(self):
+        self.write_columns = self.autopatch(
+            models, "write_columns", return_value={})
+        self.autopatch(stream_cache, "invalidate")
+        self.stream_cf = self.autopatch(models.LiveUpdateStream, "_cf")
+        self.event_cf = self.autopatch(models.LiveUpdateEvent, "_cf")
+        self.buckets_cf = self.autopatch(
+            models.LiveUpdateStreamBucketsByEvent, "_cf")
+        self.autopatch(models.LiveUpdateEvent, "_serialize_column",
+                       side_effect=lambda attr, value: value)
+
+        self.event = MagicMock(_id="abc", stream_bucketed=False)
+        self.event.stream_token_changes.return_value = {"stream_token": "t"}
+        self.update = models.LiveUpdate(data={"body": "hi"})
+
+    def test_one_mutation(self):
+        models.LiveUpdateStream.add_update(
+            self.event, self.update, event_changes={"update_count": 3})
+
+        rows = self.write_columns.call_args[0][0]
+        self.assertEqual(rows, {
+            (self.stream_cf, "abc"): {
+                self.update._id: self.update.to_column()},
+            (self.event_cf, "abc"): {"stream_token": "t", "update_count": 3},
+        })
+
+    def test_bucketed(self):
+        self.event.stream_bucketed = True
+        self.autopatch(models, "_get_stream_bucket", return_value=11)
+
+        models.LiveUpdateStream.add_update(self.event, self.update)
+
+        rows = self.write_columns.call_args[0][0]
+        self.assertEqual(set(rows), {
+            (self.stream_cf, "abc.11"),
+            (self.event_cf, "abc"),
+            (self.buckets_cf, "abc"),
+        })
+        self.assertEqual(rows[(self.buckets_cf, "abc")], {11: ""})
+
+    def test_failure_raises(self):
+        error = IOError("timed out")
+        self.write_columns.return_value = {(self.stream_cf, "abc"): error}
+        with self.assertRaises(IOError):
+            models.LiveUpdateStream.add_update(self.event, self.update)
+        stream_cache.invalidate.assert_called_once_with("abc")
@@ -3,9 +3,17 @@ import datetime
 import pytz
 
 from babel.dates import format_datetime
-from pylons import tmpl_context as c
+from pylons import app_globals as g, tmpl_context as c
 
 from r2.lib import websockets, template_helpers
+from r2.lib.db import tdb_cassandra
+
+from reddit_liveupdate.models import LiveUpdateChangesByEvent
+
+
+# broadcast types that are also recorded in the change journal so that
+# clients can catch up on them with /live/{thread}/since
+JOURNALED_TYPES = ("update", "delete", "strike", "embeds_ready")
 
 
 def pretty_time(dt, allow_relative=True):
@@ -33,3 +41,13 @@ def send_event_broadcast(event_id, type, payload):
     websockets.send_broadcast(namespace="/live/" + event_id,
                               type=type,
                               payload=payload)
+
+    if type in JOURNALED_TYPES:
+        # the change itself has already been saved, so failing to journal it
+        # only affects clients catching up and shouldn't fail the request.
+        try:
+            LiveUpdateChangesByEvent.record(event_id, type, payload)
+        except tdb_cassandra.TRANSIENT_EXCEPTIONS as e:
+            g.log.warning("Failed to journal %s for %r: %s",
+                          type, event_id, e)
+            g.stats.simple_event("liveupdate.changes_journal.failed")
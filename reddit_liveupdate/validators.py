@@ -73,6 +73,42 @@ class VLiveUpdateID(Validator):
         }
 
 
+class VLiveUpdateCursor(Validator):
+    """Validate a cursor into a thread's change journal.
+
+    Returns a (cursor, is_update) tuple. `is_update` is true if the cursor
+    was given as the fullname of an update rather than a cursor returned by
+    the API.
+
+    """
+    def run(self, cursor):
+        if not cursor:
+            return None, False
+
+        is_update = cursor.startswith("LiveUpdate_")
+        if is_update:
+            cursor = cursor[len("LiveUpdate_"):]
+
+        try:
+            cursor = uuid.UUID(cursor)
+        except (ValueError, TypeError):
+            cursor = None
+
+        if not cursor or cursor.version != 1:
+            # a client with a bad cursor can't be told it's caught up, or it
+            # would silently miss everything since.
+            self.set_error(errors.INVALID_OPTION, code=400)
+            return None, False
+        return cursor, is_update
+
+    def param_docs(self):
+        return {
+            self.param: "a cursor returned by a previous request or the "
+                        "fullname of the last update seen. e.g. "
+                        "`LiveUpdate_ff87068e-a126-11e3-9f93-12313b0b3603`",
+        }
+
+
 class VLiveUpdate(VLiveUpdateID):
     def run(self, fullname):
         id = VLiveUpdateID.run(self, fullname)
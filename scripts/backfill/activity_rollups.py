@@ -0,0 +1,47 @@
+import time
+
+from pycassa.util import convert_uuid_to_time
+
+from r2.lib import utils
+
+from reddit_liveupdate import models, scan
+
+
+def _backfill_activity_rollups(events):
+    # rolls up the raw activity samples recorded before rollups existed into
+    # hourly and daily rollups, then removes the samples that are older than
+    # the raw sample ttl. samples written before the ttl was added would
+    # otherwise never expire.
+    history = models.LiveUpdateActivityHistoryByEvent
+    rollups = models.LiveUpdateActivityRollupsByEvent
+    ttl_seconds = history._ttl.days * 24 * 60 * 60
+    cutoff = time.time() - ttl_seconds
+
+    for event in events:
+        stats = {resolution: {} for resolution in rollups.resolutions}
+        expired = []
+
+        for sample_id, count in history._cf.xget(event._id):
+            timestamp = convert_uuid_to_time(sample_id)
+            for resolution in rollups.resolutions:
+                bucket = models._get_activity_bucket(timestamp, resolution)
+                stats[resolution].setdefault(
+                    bucket, models.ActivityStats()).add(count)
+
+            if timestamp < cutoff:
+                expired.append(sample_id)
+
+        for resolution, stats_by_bucket in stats.iteritems():
+            if stats_by_bucket:
+                rollups.set_rollups(event._id, resolution, stats_by_bucket)
+
+        for chunk in utils.in_chunks(expired, size=1000):
+            history._remove(event._id, chunk)
+
+
+def backfill_activity_rollups():
+    scan.scan(models.LiveUpdateEvent, _backfill_activity_rollups,
+              name="activity_rollups")
+
+
+backfill_activity_rollups()
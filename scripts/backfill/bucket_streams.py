@@ -0,0 +1,55 @@
+from pycassa.cassandra.ttypes import NotFoundException
+
+from reddit_liveupdate import models, scan, stream_cache
+
+
+# only move streams at least this long; short streams gain nothing from it.
+MIN_UPDATES = 1000
+
+
+def _has_updates(event):
+    try:
+        models.LiveUpdateStream._cf.get(event._id, column_count=1)
+    except NotFoundException:
+        return False
+    return True
+
+
+def _bucket_streams(events):
+    # moves the streams of long threads from a single row keyed by the event
+    # id to one row per time bucket.
+    #
+    # the stream is copied once, then the event is flipped over to the
+    # bucketed layout, then copied again to pick up anything written by
+    # requests that loaded the event before the flip. requests can still
+    # write to the old row for a little while after that, so it is left in
+    # place; remove_unbucketed_streams.py copies anything written late and
+    # removes the old rows once those requests are long gone.
+    for event in events:
+        if event.stream_bucketed:
+            continue
+
+        if "update_count" not in event._t and _has_updates(event):
+            raise Exception("%s has no update_count. run "
+                            "scripts/backfill/stream_summaries.py first."
+                            % event._id)
+
+        if event.update_count < MIN_UPDATES:
+            continue
+
+        models.LiveUpdateStream.copy_unbucketed_row(event)
+        event._partial_update(stream_bucketed=True)
+        models.LiveUpdateStream.copy_unbucketed_row(event)
+
+        stream_cache.invalidate(event._id)
+        print "bucketed %s" % event._id
+
+
+def bucket_streams():
+    # runs in a single process because invalidating the stream cache may use
+    # memcached connections, which can't be shared with forked workers.
+    scan.scan(models.LiveUpdateEvent, _bucket_streams,
+              name="bucket_streams", processes=1)
+
+
+bucket_streams()
@@ -0,0 +1,35 @@
+from r2.lib import utils
+
+from reddit_liveupdate import encoding, models, scan
+
+
+def _compact_streams(events):
+    # rewrites every update still stored as a plain json object (or an older
+    # compact version) in the current compact column format. each column is
+    # written back with a timestamp just after the one it was read with, so a
+    # strike, delete or embed written to it after the read still wins and
+    # this is safe to run while the site is live.
+    for event in events:
+        for rowkey in models.LiveUpdateStream._rowkeys(event):
+            columns = models.LiveUpdateStream._cf.xget(
+                rowkey, include_timestamp=True)
+            stale = ((id, value, timestamp)
+                     for id, (value, timestamp) in columns
+                     if not encoding.is_current(value))
+
+            for chunk in utils.in_chunks(stale, size=100):
+                rewritten = {
+                    id: (encoding.encode(encoding.decode(value),
+                                         defaults=models.LiveUpdate.defaults),
+                         timestamp + 1)
+                    for id, value, timestamp in chunk
+                }
+                models.insert_with_timestamps(
+                    models.LiveUpdateStream._cf, rowkey, rewritten)
+
+
+def compact_streams():
+    scan.scan(models.LiveUpdateEvent, _compact_streams, name="compact_streams")
+
+
+compact_streams()
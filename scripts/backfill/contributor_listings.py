@@ -1,11 +1,9 @@
 from r2.models.query_cache import CachedQueryMutator
 
-from reddit_liveupdate import models, queries
+from reddit_liveupdate import models, queries, scan
 
 
-def backfill_listings():
-    events = models.LiveUpdateEvent._all()
-
+def _backfill_listings(events):
     with CachedQueryMutator() as m:
         for event in events:
             for contributor_id in event.contributors.iterkeys():
@@ -16,4 +14,9 @@ def backfill_listings():
                 m.insert(queries.get_contributor_events(invitee_id), [event])
 
 
+def backfill_listings():
+    scan.scan(models.LiveUpdateEvent, _backfill_listings,
+              name="backfill_contributor_listings")
+
+
 backfill_listings()
@@ -0,0 +1,22 @@
+from reddit_liveupdate import models, pages, scan
+
+
+def _backfill_event_html(events):
+    # stores the rendered description and resources of events that predate
+    # html being stored at create/edit time.
+    for event in events:
+        changes = {}
+        for attr in ("description", "resources"):
+            if getattr(event, attr + "_html", None) is None:
+                changes[attr + "_html"] = pages.render_event_markdown(
+                    getattr(event, attr))
+
+        if changes:
+            event._partial_update(**changes)
+
+
+def backfill_event_html():
+    scan.scan(models.LiveUpdateEvent, _backfill_event_html, name="event_html")
+
+
+backfill_event_html()
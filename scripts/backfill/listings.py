@@ -1,16 +1,14 @@
 from r2.models.query_cache import CachedQueryMutator
 
-from reddit_liveupdate import models, queries
+from reddit_liveupdate import models, queries, scan
 
 
-def backfill_listings():
+def _backfill_listings(events):
     queries_by_state = {
         "live": queries.get_live_events,
         "complete": queries.get_complete_events,
     }
 
-    events = models.LiveUpdateEvent._all()
-
     with CachedQueryMutator() as m:
         for event in events:
             query_fn = queries_by_state[event.state]
@@ -18,4 +16,9 @@ def backfill_listings():
             m.insert(query, [event])
 
 
+def backfill_listings():
+    scan.scan(models.LiveUpdateEvent, _backfill_listings,
+              name="backfill_listings")
+
+
 backfill_listings()
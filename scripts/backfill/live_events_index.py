@@ -0,0 +1,16 @@
+from reddit_liveupdate import models, scan
+
+
+def _backfill_live_events_index(events):
+    live_ids = [event._id for event in events
+                if event.state == "live" and not event.banned]
+    if live_ids:
+        models.LiveUpdateLiveEventsIndex.add(live_ids)
+
+
+def backfill_live_events_index():
+    scan.scan(models.LiveUpdateEvent, _backfill_live_events_index,
+              name="live_events_index")
+
+
+backfill_live_events_index()
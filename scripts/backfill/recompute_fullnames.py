@@ -4,7 +4,11 @@ from pycassa.columnfamily import gm_timestamp
 
 from r2.models.query_cache import CachedQueryMutator, MAX_CACHED_ITEMS
 
-from reddit_liveupdate import models, queries
+from reddit_liveupdate import models, queries, scan
+
+
+def _get_listing_keys(events):
+    return [(event.state, event._date, event._id) for event in events]
 
 
 def recompute_listings():
@@ -17,23 +21,26 @@ def recompute_listings():
     # now. in the latter case, humans should ensure that the listing is empty
     # of reports before running this job.
 
-    items_by_state = collections.defaultdict(list)
+    keys_by_state = collections.defaultdict(list)
     queries_by_state = {
         "live": queries.get_live_events,
         "complete": queries.get_complete_events,
     }
 
-    for event in models.LiveUpdateEvent._all():
-        items_by_state[event.state].append(event)
+    results = scan.scan(models.LiveUpdateEvent, _get_listing_keys,
+                        name="recompute_fullnames")
+    for keys in results:
+        for state, date, event_id in keys:
+            keys_by_state[state].append((date, event_id))
 
     timestamp = gm_timestamp()
     with CachedQueryMutator() as m:
         for state, query_fn in queries_by_state.iteritems():
             query = query_fn("new", "all")
 
-            items = items_by_state[state]
-            sorted_items = sorted(items, key=lambda ev: ev._date, reverse=True)
-            listing = [item for item in sorted_items][:MAX_CACHED_ITEMS]
+            keys = sorted(keys_by_state[state], reverse=True)
+            event_ids = [event_id for date, event_id in keys][:MAX_CACHED_ITEMS]
+            listing = models.LiveUpdateEvent._byID(event_ids, return_dict=False)
             cols = query._cols_from_things(listing)
 
             query._raw_replace(
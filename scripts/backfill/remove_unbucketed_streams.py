@@ -0,0 +1,25 @@
+from reddit_liveupdate import models, scan, stream_cache
+
+
+def _remove_unbucketed_streams(events):
+    # removes the single-row streams left behind by bucket_streams.py. run
+    # this well after bucketing (a day is plenty) so that no request that
+    # loaded an event before it was bucketed can still write to the old row.
+    # anything such requests wrote there is copied over one last time first.
+    for event in events:
+        if not event.stream_bucketed:
+            continue
+
+        models.LiveUpdateStream.copy_unbucketed_row(event)
+        models.LiveUpdateStream._cf.remove(event._id)
+        stream_cache.invalidate(event._id)
+        print "removed unbucketed stream of %s" % event._id
+
+
+def remove_unbucketed_streams():
+    # single process for the same reason as bucket_streams.
+    scan.scan(models.LiveUpdateEvent, _remove_unbucketed_streams,
+              name="remove_unbucketed_streams", processes=1)
+
+
+remove_unbucketed_streams()
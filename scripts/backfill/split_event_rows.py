@@ -0,0 +1,58 @@
+from pycassa.cassandra.ttypes import NotFoundException
+
+from reddit_liveupdate import models, scan
+
+
+def _split_event_rows(events):
+    # moves contributors and hidden discussions out of each event's own row
+    # and into their dedicated column families, then removes the legacy
+    # columns so that loading an event only reads its metadata.
+    #
+    # the copies are written with the legacy columns' own timestamps, so a
+    # permission change or removal made through the new column families
+    # while this runs is newer and wins over the copy.
+    Event = models.LiveUpdateEvent
+
+    for event in events:
+        legacy_columns = [k for k in event._t
+                          if k.startswith(Event._contributor_prefix) or
+                             k.startswith(Event._discussion_prefix)]
+        if not legacy_columns:
+            continue
+
+        try:
+            columns = Event._cf.get(
+                event._id, columns=legacy_columns, include_timestamp=True)
+        except NotFoundException:
+            continue
+
+        contributors = {}
+        discussions = {}
+        for k, (value, timestamp) in columns.iteritems():
+            if k.startswith(Event._contributor_prefix):
+                id36 = k[len(Event._contributor_prefix):]
+                contributors[id36] = (value, timestamp)
+            else:
+                id36 = k[len(Event._discussion_prefix):]
+                discussions[id36] = ("", timestamp)
+
+        if contributors:
+            models.insert_with_timestamps(
+                models.LiveUpdateContributorsByEvent._cf,
+                event._id, contributors)
+        if discussions:
+            models.insert_with_timestamps(
+                models.LiveUpdateHiddenDiscussionsByEvent._cf,
+                event._id, discussions)
+
+        for k in columns:
+            del event[k]
+        event._commit()
+
+
+def split_event_rows():
+    scan.scan(models.LiveUpdateEvent, _split_event_rows,
+              name="split_event_rows")
+
+
+split_event_rows()
@@ -0,0 +1,36 @@
+from reddit_liveupdate import models, scan
+
+
+def _backfill_stream_summaries(events):
+    # (re)computes the denormalized update counters and last update time of
+    # each event from its stream. safe to re-run to repair counters that have
+    # drifted.
+    for event in events:
+        update_count = 0
+        deleted_count = 0
+        last_update_at = None
+
+        for rowkey in models.LiveUpdateStream._rowkeys(event):
+            for id, value in models.LiveUpdateStream._cf.xget(rowkey):
+                update = models.LiveUpdate.from_column(id, value)
+                update_count += 1
+                if update.deleted:
+                    deleted_count += 1
+                if not last_update_at or update._date > last_update_at:
+                    last_update_at = update._date
+
+        changes = {
+            "update_count": update_count,
+            "deleted_count": deleted_count,
+        }
+        if last_update_at:
+            changes["last_update_at"] = last_update_at
+        event._partial_update(**changes)
+
+
+def backfill_stream_summaries():
+    scan.scan(models.LiveUpdateEvent, _backfill_stream_summaries,
+              name="stream_summaries")
+
+
+backfill_stream_summaries()
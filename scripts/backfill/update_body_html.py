@@ -0,0 +1,38 @@
+from r2.lib import utils
+
+from reddit_liveupdate import models, pages, scan
+
+
+def _prerender_update_bodies(events):
+    # stores rendered html on every update whose html is missing or was
+    # rendered by an older version of the renderer. updates that aren't
+    # backfilled still work, they're just rendered on every read.
+    #
+    # like compact_streams, columns are written back with a timestamp just
+    # after the one they were read with so that concurrent strikes, deletes
+    # and embeds aren't reverted.
+    for event in events:
+        for rowkey in models.LiveUpdateStream._rowkeys(event):
+            columns = models.LiveUpdateStream._cf.xget(
+                rowkey, include_timestamp=True)
+            updates = ((models.LiveUpdate.from_column(id, value), timestamp)
+                       for id, (value, timestamp) in columns)
+            stale = ((update, timestamp) for update, timestamp in updates
+                     if getattr(update, "body_html_version", None) !=
+                        pages.BODY_HTML_VERSION)
+
+            for chunk in utils.in_chunks(stale, size=100):
+                rewritten = {}
+                for update, timestamp in chunk:
+                    pages.prerender_update_body(update)
+                    rewritten[update._id] = (update.to_column(), timestamp + 1)
+                models.insert_with_timestamps(
+                    models.LiveUpdateStream._cf, rowkey, rewritten)
+
+
+def prerender_update_bodies():
+    scan.scan(models.LiveUpdateEvent, _prerender_update_bodies,
+              name="update_body_html")
+
+
+prerender_update_bodies()
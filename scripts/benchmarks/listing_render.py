@@ -0,0 +1,47 @@
+import time
+
+from reddit_liveupdate import models, pages
+
+
+PAGE_SIZE = 25
+PAGES = 200
+
+BODY = u"""\
+**Update:** officials confirmed [the report](http://example.com/report) and
+said more details would follow.
+
+* first point
+* second point with `code`
+
+> quoted from a press release
+"""
+
+
+def make_page(prerendered):
+    updates = []
+    for i in xrange(PAGE_SIZE):
+        update = models.LiveUpdate(data={
+            "author_id": 1,
+            "body": BODY,
+        })
+        if prerendered:
+            pages.prerender_update_body(update)
+        updates.append(models.LiveUpdate.from_column(
+            update._id, update.to_column()))
+    return updates
+
+
+def benchmark_listing_render():
+    for name, prerendered in (("render", False), ("stored", True)):
+        page = make_page(prerendered)
+
+        start = time.time()
+        for i in xrange(PAGES):
+            for update in page:
+                pages.get_update_body_html(update)
+        elapsed = time.time() - start
+
+        print "%-7s %.3fms per page" % (name, elapsed / PAGES * 1000)
+
+
+benchmark_listing_render()
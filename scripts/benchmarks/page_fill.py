@@ -0,0 +1,130 @@
+import random
+import time
+
+from r2.models import QueryBuilder
+
+from reddit_liveupdate import models
+
+
+STREAM_SIZE = 5000
+DELETED_FRACTION = 0.5
+PAGE_SIZE = 25
+PAGES = 20
+
+
+class InMemoryStreamQuery(object):
+    """Mimics tdb_cassandra.ColumnQuery over an in-memory stream."""
+    chunk_size = 100
+
+    def __init__(self, columns, stats):
+        self.columns = columns
+        self.stats = stats
+        self.column_start = None
+        self._limit = 100
+        self._rules = []
+
+    def _reverse(self):
+        self.columns = list(reversed(self.columns))
+
+    def _after(self, item):
+        self.column_start = item._id
+
+    def __iter__(self):
+        ids = [id for id, value in self.columns]
+        position = ids.index(self.column_start) + 1 if self.column_start else 0
+        retrieved = 0
+        while retrieved < self._limit:
+            count = min(self.chunk_size, self._limit - retrieved)
+            chunk = self.columns[position:position + count]
+            self.stats["round_trips"] += 1
+            self.stats["columns_read"] += len(chunk)
+            if not chunk:
+                return
+
+            for id, value in chunk:
+                item = models.LiveUpdate.from_column(id, value)
+                self.stats["objects"].append(item)
+                yield item
+
+            retrieved += len(chunk)
+            position += len(chunk)
+
+
+class BenchmarkBuilder(QueryBuilder):
+    def __init__(self, *args, **kwargs):
+        self.stats = kwargs.pop("stats")
+        QueryBuilder.__init__(self, *args, **kwargs)
+
+    def fetch_more(self, last_item, num_have):
+        self.stats["builder_rounds"] += 1
+        return QueryBuilder.fetch_more(self, last_item, num_have)
+
+    def wrap_items(self, items):
+        return list(items)
+
+    def keep_item(self, item):
+        return not item.deleted and not item._spam
+
+
+def make_stream():
+    columns = []
+    tombstones = set()
+    for i in xrange(STREAM_SIZE):
+        update = models.LiveUpdate(data={
+            "author_id": 1,
+            "body": "update number %d" % i,
+            "deleted": random.random() < DELETED_FRACTION,
+        })
+        if update.deleted:
+            tombstones.add(update._id)
+        columns.append((update._id, update.to_column()))
+    columns.reverse()
+    return columns, tombstones
+
+
+def fill_pages(columns, tombstones):
+    stats = {
+        "builder_rounds": 0,
+        "round_trips": 0,
+        "columns_read": 0,
+        "objects": [],
+    }
+
+    start = time.time()
+    after = None
+    for i in xrange(PAGES):
+        query = InMemoryStreamQuery(columns, stats)
+        query.column_start = after
+        if tombstones is not None:
+            query = models.TombstoneSkippingQuery(query, tombstones)
+
+        builder = BenchmarkBuilder(query=query, skip=True, num=PAGE_SIZE,
+                                   stats=stats)
+        items = builder.get_items()[0]
+        after = items[-1]._id
+    elapsed = time.time() - start
+
+    stats["objects"] = len(stats["objects"])
+    stats["ms_per_page"] = elapsed / PAGES * 1000
+    return stats
+
+
+def benchmark_page_fill():
+    random.seed(0)
+    columns, tombstones = make_stream()
+
+    for name, tombstone_index in (("keep_item", None),
+                                  ("tombstones", tombstones)):
+        stats = fill_pages(columns, tombstone_index)
+        print ("%-10s per page: %4.1f builder rounds, %4.1f round trips, "
+               "%6.1f columns read, %6.1f objects built, %.2fms") % (
+            name,
+            float(stats["builder_rounds"]) / PAGES,
+            float(stats["round_trips"]) / PAGES,
+            float(stats["columns_read"]) / PAGES,
+            float(stats["objects"]) / PAGES,
+            stats["ms_per_page"],
+        )
+
+
+benchmark_page_fill()
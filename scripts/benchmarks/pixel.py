@@ -0,0 +1,42 @@
+import time
+
+from paste.deploy import loadapp
+from pylons import config
+from webob import Request
+
+from reddit_liveupdate.pixel import PixelApp
+
+
+REQUESTS = 5000
+PATH = "/live/benchmark/pixel.png"
+
+
+def make_request(i):
+    request = Request.blank(PATH, environ={
+        "REMOTE_ADDR": "10.0.%d.%d" % (i // 256 % 256, i % 256),
+        "HTTP_HOST": config["liveupdate_pixel_domain"],
+        "HTTP_USER_AGENT": "benchmark",
+    })
+    return request
+
+
+def requests_per_second(app):
+    start = time.time()
+    for i in xrange(REQUESTS):
+        response = make_request(i).get_response(app)
+        assert response.status_int == 200, response.status
+    return REQUESTS / (time.time() - start)
+
+
+def benchmark_pixel():
+    # runs each request through a single worker's full wsgi stack, once as
+    # configured (pylons routing to LiveUpdatePixelController) and once with
+    # PixelApp in front of it.
+    pylons_app = loadapp("config:" + config["__file__"])
+
+    for name, app in (("controller", pylons_app),
+                      ("wsgi", PixelApp(pylons_app))):
+        print "%-10s %8.1f requests/sec" % (name, requests_per_second(app))
+
+
+benchmark_pixel()
@@ -0,0 +1,66 @@
+import json
+import timeit
+import uuid
+
+from reddit_liveupdate import encoding, models
+
+
+SAMPLE_SIZE = 10000
+SAMPLE_BODY = (
+    "**BREAKING** officials have confirmed the evacuation order for the "
+    "downtown area. more details as they come in.\n\n"
+    "https://twitter.com/example/status/123456789012345678"
+)
+SAMPLE_MEDIA = [{
+    "type": "twitter.com",
+    "oembed": {
+        "url": "https://twitter.com/example/status/123456789012345678",
+        "width": 485,
+        "height": 0,
+        "html": "<blockquote class=\"twitter-tweet\">...</blockquote>",
+    },
+}]
+
+
+def make_updates():
+    updates = []
+    for i in xrange(SAMPLE_SIZE):
+        data = {
+            "author_id": 1000 + i % 25,
+            "body": SAMPLE_BODY,
+            "_spam": False,
+        }
+        if i % 3 == 0:
+            data["media_objects"] = SAMPLE_MEDIA
+            data["mobile_objects"] = [SAMPLE_MEDIA[0]["oembed"]]
+        if i % 20 == 0:
+            data["stricken"] = True
+        updates.append(models.LiveUpdate(uuid.uuid1(), data))
+    return updates
+
+
+def benchmark_stream_encoding():
+    updates = make_updates()
+    legacy = [json.dumps(u._data).decode("utf-8") for u in updates]
+    compact = [u.to_column() for u in updates]
+
+    def decode_legacy():
+        for value in legacy:
+            encoding.decode(value)
+
+    def decode_compact():
+        for value in compact:
+            encoding.decode(value)
+
+    for name, values, fn in (("json", legacy, decode_legacy),
+                             ("compact", compact, decode_compact)):
+        size = sum(len(v.encode("utf-8")) for v in values)
+        elapsed = min(timeit.repeat(fn, repeat=5, number=1))
+        print "%-8s %7.1f bytes/update  %6.2f us/decode" % (
+            name,
+            float(size) / len(values),
+            elapsed / len(values) * 1e6,
+        )
+
+
+benchmark_stream_encoding()
@@ -12,7 +12,10 @@ setup(name='reddit_liveupdate',
     ],
     entry_points={
         'r2.plugin':
-            ['liveupdate = reddit_liveupdate:LiveUpdate']
+            ['liveupdate = reddit_liveupdate:LiveUpdate'],
+        'paste.filter_app_factory':
+            ['liveupdate_pixel = reddit_liveupdate.pixel:make_pixel_filter',
+             'liveupdate_stream = reddit_liveupdate.sse:make_stream_filter'],
     },
     zip_safe=False,
 )